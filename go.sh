@@ -11,7 +11,9 @@ if [[ ${VIRTUAL_ENV:-} = "" ]] ; then
 	source venv/bin/activate
 fi
 
-tmpdir="/run/user/$UID/mc-worlds"
+# snapshot_worlds can be set in settings.inc; if it's on the same filesystem
+# as source_worlds then the world db can be hardlinked rather than copied
+tmpdir="${snapshot_worlds:-/run/user/$UID/mc-worlds}"
 if ! [[ -e $tmpdir ]]  ; then
 	mkdir -p "$tmpdir"
 fi
@@ -20,13 +22,42 @@ if ! [[ -e worlds ]] ; then
 	ln -s "$tmpdir" worlds
 fi
 
-if [[ -e worlds ]] && [[ ! -l worlds ]]; then
+if [[ -e worlds ]] && [[ ! -L worlds ]]; then
   echo "expected worlds dir to be a symlink" >&2
   exit 1
 fi
 
+# Snapshot the world so that we can read it while the server has the db locked
+#
+# leveldb table files (*.ldb) are never modified once written so they can be
+# hardlinked; only the files that leveldb appends to (CURRENT, MANIFEST-*,
+# *.log) need a real copy. If hardlinking isn't possible (eg the snapshot is on
+# a different filesystem) then fall back to copying everything.
+snapshot_world() {
+	local src="$1"
+	local dest="$2"
+
+	local first_table
+	first_table=$( find "$src/db" -maxdepth 1 -name '*.ldb' -print -quit )
+	mkdir -p "$dest/db"
+	if [[ $first_table = "" ]] || ! ln "$first_table" "$dest/db/" 2>/dev/null ; then
+		echo "Can't hardlink $src/db; copying" >&2
+		rm -rf "$dest"
+		cp -pr --reflink=auto "$src" "$dest"
+		return
+	fi
+
+	# everything except the db
+	find "$src" -mindepth 1 -maxdepth 1 ! -name db -exec cp -pr --reflink=auto {} "$dest/" \;
+
+	# as with a plain cp this can race with a compaction if the server is
+	# running; if the snapshot won't open then just run it again
+	find "$src/db" -maxdepth 1 -type f ! -name '*.ldb' -exec cp -p --reflink=auto {} "$dest/db/" \;
+	find "$src/db" -maxdepth 1 -type f -name '*.ldb' ! -samefile "$first_table" -exec ln {} "$dest/db/" \;
+}
+
 rm -rf "worlds/$level_name"
-cp -pr "$source_worlds/$level_name" worlds/
+snapshot_world "$source_worlds/$level_name" "worlds/$level_name"
 
 newest_file=$( ls -1 -t  "worlds/$level_name/db" | head -n 2 | tail -n 1 )
 touch -r "$source_worlds/$level_name/db/$newest_file" "worlds/$level_name/last_updated"
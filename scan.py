@@ -1,23 +1,83 @@
 #!/usr/bin/env python3
+from __future__ import annotations
+
 import argparse
+import contextlib
+import cProfile
+from collections import Counter
+from collections import OrderedDict
 from collections import defaultdict
+from collections import deque
 from datetime import datetime
-import dotenv
 import functools
-import humanize
-import itertools
+import heapq
+import importlib.util
+import io
 import json
 import logging
+import math
 import os
+import resource
+import shlex
+import signal
+import socket
+import socketserver
 from pathlib import Path
+import struct
 import sys
+import time
+from typing import Iterator
+from typing import NamedTuple
+from typing import Optional
 from typing import Tuple
+from typing import Union
+
+
+def lazy_import(name: str):
+    """
+    Import a module the first time something in it is used, to keep startup fast
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+concurrent_futures = lazy_import('concurrent.futures')
+gzip = lazy_import('gzip')
+hashlib = lazy_import('hashlib')
+humanize = lazy_import('humanize')
+multiprocessing = lazy_import('multiprocessing')
+np = lazy_import('numpy')
+shutil = lazy_import('shutil')
+subprocess = lazy_import('subprocess')
+tempfile = lazy_import('tempfile')
+zipfile = lazy_import('zipfile')
+
+# loaded by import_bedrock(), which also loads libleveldb.so
+bedrock = None
+
+
+def import_bedrock():
+    """
+    Import the bedrock library the first time a world is actually opened
+    """
+    global bedrock
+    if bedrock is None:
+        bedrock_path = Path(__file__).parent.parent / "bedrock"
+        if not bedrock_path.exists() or not bedrock_path.is_dir():
+            raise RuntimeError(f'bedrock library not found at {bedrock_path}')
+        sys.path[1:1] = [str(bedrock_path)]
+        import bedrock.leveldb
+    return bedrock
 
-bedrock_path = Path(__file__).parent.parent / "bedrock"
-if not bedrock_path.exists() or not bedrock_path.is_dir():
-    raise RuntimeError(f'bedrock library not found at {bedrock_path}')
-sys.path[1:1] = [str(bedrock_path)]
-import bedrock.leveldb
 
 # timings for potential future json output
 # time: 32x32 => 3.37 sec,
@@ -30,12 +90,15 @@ import bedrock.leveldb
 BlockGroupType = str
 BlockType = str
 Coords = Tuple[int, int, int]
-DistCoords = Tuple[float, int, int, int]
+PaletteEntry = Tuple[BlockType, Optional[str]]
+# coordinates of matching blocks: a list of (N, 3) x,y,z arrays per (canonical) block name
+Hits = dict[BlockType, list['np.ndarray']]
 
 # ---------------------------------------------------------------------------
 
 @functools.lru_cache()
 def get_config():
+    import dotenv
     config_path = Path(__file__).parent.joinpath('settings.inc')
     dotenv.load_dotenv(dotenv_path=config_path)
     config_vars = [
@@ -45,10 +108,23 @@ def get_config():
     return {key: os.getenv(key) for key in config_vars}
 
 
+def get_default_world_path() -> Path:
+    # only read settings.inc if --world wasn't given
+    return Path(__file__).parent.joinpath('worlds', get_config()['level_name'])
+
+
 DEFAULT_MAX_DIST = 20
-DEFAULT_WORLD_PATH = Path(__file__).parent.joinpath('worlds', get_config()['level_name'])
+DEFAULT_INDEX_PATH = Path(__file__).parent.joinpath('index')
+DEFAULT_SOCKET_PATH = Path(__file__).parent.joinpath('scan.sock')
+DEFAULT_SERVE_CACHE_MB = 512
+
+FORMATS = ('text', 'text_closest', 'json', 'clusters', 'clusters_json', 'ndjson', 'ndjson.gz', 'ndjson.zst', 'npz')
+# formats written as the scan goes rather than once everything has been found
+STREAM_FORMATS = ('ndjson', 'ndjson.gz', 'ndjson.zst', 'npz')
+BINARY_FORMATS = ('ndjson.gz', 'ndjson.zst', 'npz')
 
 logger: logging.Logger = None
+LOG_FORMAT = '%(levelname)-8s %(message)s'
 
 # y coordinate ranges
 Y_MIN = -63
@@ -206,10 +282,18 @@ OPTIONAL_BLOCKS: dict[BlockGroupType, set[BlockType]] = {
         'minecraft:iron_ore',
         'minecraft:raw_iron_block',
     },
-    'kelp': 'minecraft:kelp',
-    'lava': 'minecraft:lava',
-    'magma': 'minecraft:magma',
-    'obsidian': 'minecraft:obsidian',
+    'kelp': {
+        'minecraft:kelp',
+    },
+    'lava': {
+        'minecraft:lava',
+    },
+    'magma': {
+        'minecraft:magma',
+    },
+    'obsidian': {
+        'minecraft:obsidian',
+    },
     'redstone': {
         'minecraft:deepslate_redstone_ore',
         'minecraft:redstone_ore',
@@ -369,326 +453,3958 @@ IGNORE: set[BlockType] = {
     'minecraft:quartz_ore',
 }
 
-def init_logger(log_level: int) -> logging.Logger:
-    levels = {
-        0: logging.WARNING,
-        1: logging.INFO,
-        2: logging.DEBUG
-    }
-    level = levels[min(len(levels), log_level)]
-    logging.basicConfig(level=level, format='%(levelname)-8s %(message)s')
-    logger = logging.getLogger('mc-scan')
-    return logger
+# ---------------------------------------------------------------------------
+# Raw chunk access
+#
+# world.getBlock() does a chunk lookup (and builds a Block object) for every
+# single block. Instead we pull the subchunk records straight out of leveldb
+# and decode each 16x16x16 subchunk into a dense array of palette indices
+#  - https://minecraft.fandom.com/wiki/Bedrock_Edition_level_format
+
+CHUNK_SIZE = 16
+# width (in chunks) of the tiles handed to each worker process when using --jobs
+TILE_CHUNKS = 4
+SUBCHUNK_BLOCKS = CHUNK_SIZE * CHUNK_SIZE * CHUNK_SIZE
+
+# leveldb key tags
+TAG_VERSION = 44
+TAG_SUBCHUNK_PREFIX = 47
+TAG_BLOCK_ENTITY = 49
+TAG_LEGACY_VERSION = 118
+
+# subchunk bitmasks (see ChunkPresence) have bit 0 for this subchunk y
+PRESENCE_MIN_SUBCHUNK_Y = -32
+# a bitmask for when which subchunks are stored isn't known
+ALL_SUBCHUNKS = -1
+
+# block entity ids (as stored in a chunk's TAG_BLOCK_ENTITY record) and the
+# block each belongs to; trapped chests are also "Chest"
+BLOCK_ENTITY_BLOCKS: dict[str, BlockType] = {
+    'Chest': 'minecraft:chest',
+    'MobSpawner': 'minecraft:mob_spawner',
+    'BrewingStand': 'minecraft:brewing_stand',
+}
+
+NBT_END = 0
+NBT_LIST = 9
+NBT_COMPOUND = 10
+NBT_STRING = 8
+NBT_SCALARS = {
+    1: struct.Struct('<b'),
+    2: struct.Struct('<h'),
+    3: struct.Struct('<i'),
+    4: struct.Struct('<q'),
+    5: struct.Struct('<f'),
+    6: struct.Struct('<d'),
+}
+NBT_ARRAYS = {
+    7: struct.Struct('<b'),
+    11: struct.Struct('<i'),
+    12: struct.Struct('<q'),
+}
+UINT16 = struct.Struct('<H')
+INT32 = struct.Struct('<i')
+
+
+def chunk_key(chunk_x: int, chunk_z: int, dimension: int, tag: int, subchunk_y: Optional[int] = None) -> bytes:
+    key = struct.pack('<ii', chunk_x, chunk_z)
+    if dimension != 0:
+        key += INT32.pack(dimension)
+    key += bytes((tag, ))
+    if subchunk_y is not None:
+        key += struct.pack('<b', subchunk_y)
+    return key
+
+
+def read_nbt_payload(data: bytes, offset: int, tag_type: int):
+    if tag_type in NBT_SCALARS:
+        fmt = NBT_SCALARS[tag_type]
+        return fmt.unpack_from(data, offset)[0], offset + fmt.size
+
+    if tag_type == NBT_STRING:
+        length, = UINT16.unpack_from(data, offset)
+        offset += UINT16.size
+        return data[offset:offset+length].decode('utf-8', errors='replace'), offset + length
+
+    if tag_type in NBT_ARRAYS:
+        fmt = NBT_ARRAYS[tag_type]
+        count, = INT32.unpack_from(data, offset)
+        offset += INT32.size
+        values = list(struct.unpack_from(f'<{count}{fmt.format[-1]}', data, offset))
+        return values, offset + count * fmt.size
+
+    if tag_type == NBT_LIST:
+        item_type = data[offset]
+        count, = INT32.unpack_from(data, offset + 1)
+        offset += 1 + INT32.size
+        values = []
+        for _ in range(count):
+            value, offset = read_nbt_payload(data, offset, item_type)
+            values.append(value)
+        return values, offset
+
+    if tag_type == NBT_COMPOUND:
+        values = {}
+        while True:
+            item_type = data[offset]
+            offset += 1
+            if item_type == NBT_END:
+                return values, offset
+            name, offset = read_nbt_payload(data, offset, NBT_STRING)
+            values[name], offset = read_nbt_payload(data, offset, item_type)
+
+    raise Exception(f'Unknown NBT tag type {tag_type}')
+
+
+def read_nbt(data: bytes, offset: int = 0):
+    """
+    Read a single named little-endian NBT tag
+
+    Returns the decoded value and the offset immediately after it
+    """
+    tag_type = data[offset]
+    _name, offset = read_nbt_payload(data, offset + 1, NBT_STRING)
+    return read_nbt_payload(data, offset, tag_type)
+
+
+class BlockInfo(NamedTuple):
+    """
+    Everything about a block name that doesn't depend on the query
+    """
+    id: int
+    name: BlockType
+    # the name it's reported under (see canonical_name())
+    canonical: BlockType
+    # DV_* lookup for its data value, if it has one
+    dv: Optional[dict[int, str]]
+
+
+# every block name seen so far (by this process), indexed by id; ids are
+# handed out in the order names are first seen so they're only meaningful
+# within a process
+BLOCKS: list[BlockInfo] = []
+BLOCK_IDS: dict[BlockType, int] = {}
+
+
+def intern_block(name: BlockType) -> int:
+    """
+    The small integer id for a block name
+    """
+    block_id = BLOCK_IDS.get(name)
+    if block_id is None:
+        block_id = BLOCK_IDS[name] = len(BLOCKS)
+        BLOCKS.append(BlockInfo(block_id, name, canonical_name(name), DV_LOOKUPS.get(name)))
+    return block_id
+
+
+def decode_palette_entry(entry: dict) -> Tuple[int, PaletteEntry]:
+    """
+    The interned block id and (name, dv) of a palette entry
+    """
+    block_id = intern_block(entry['name'])
+    name, dv_lookup = BLOCKS[block_id].name, BLOCKS[block_id].dv
+    return block_id, (name, dv_lookup.get(entry.get('val')) if dv_lookup else None)
+
+
+class SubChunk:
+    """
+    A single 16x16x16 subchunk record; the block storage is only unpacked when
+    `blocks` is first used
+    """
+
+    def __init__(self, data: bytes):
+        version = data[0]
+        if version == 1:
+            offset = 1
+        elif version == 8:
+            offset = 2
+        elif version == 9:
+            # version 9 adds the subchunk y index after the storage count
+            offset = 3
+        else:
+            raise NotImplementedError(f'Unsupported subchunk version {version}')
+
+        # only the first block storage is read (this is the same as getBlock()'s
+        # default layer=0); the 2nd storage is used for things like waterlogging
+        self.data = data
+        self.bits_per_block = data[offset] >> 1
+        offset += 1
+        self.blocks_offset = offset
+        if self.bits_per_block:
+            blocks_per_word = 32 // self.bits_per_block
+            self.word_count = -(-SUBCHUNK_BLOCKS // blocks_per_word)
+            offset += self.word_count * 4
+
+        palette_size, = INT32.unpack_from(data, offset)
+        offset += INT32.size
+        self.palette: list[PaletteEntry] = []
+        palette_ids = []
+        for _ in range(palette_size):
+            entry, offset = read_nbt(data, offset)
+            block_id, palette_entry = decode_palette_entry(entry)
+            palette_ids.append(block_id)
+            self.palette.append(palette_entry)
+        self.palette_ids = np.array(palette_ids, dtype=np.intp)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by this subchunk once its blocks have been unpacked
+        """
+        return len(self.data) + SUBCHUNK_BLOCKS * np.dtype(np.uint16).itemsize + len(self.palette) * 200
+
+    @functools.cached_property
+    def blocks(self) -> np.ndarray:
+        """
+        Palette indices, indexed as [x][z][y]
+        """
+        if self.bits_per_block == 0:
+            indices = np.zeros(SUBCHUNK_BLOCKS, dtype=np.uint16)
+        else:
+            words = np.frombuffer(self.data, dtype='<u4', count=self.word_count, offset=self.blocks_offset)
+            shifts = np.arange(32 // self.bits_per_block, dtype=np.uint32) * self.bits_per_block
+            mask = (1 << self.bits_per_block) - 1
+            indices = ((words[:, None] >> shifts) & mask).reshape(-1)[:SUBCHUNK_BLOCKS].astype(np.uint16)
+        return indices.reshape(CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE)
+
+
+@contextlib.contextmanager
+def open_world_db(world_path: Path):
+    """
+    Open a world's leveldb for reading
+
+    go.sh snapshots hardlink the live world's table files, so nothing here may ever put/delete
+    """
+    db_path = Path(world_path) / 'db'
+    # leveldb will happily create an empty db if pointed at the wrong place
+    if not (db_path / 'CURRENT').exists():
+        raise Exception(f'No world database found at {db_path}')
+    import_bedrock()
+    db = bedrock.leveldb.open(str(db_path))
+    try:
+        yield db
+    finally:
+        bedrock.leveldb.close(db)
+
+
+def has_chunk(db, dimension: int, chunk_x: int, chunk_z: int) -> bool:
+    for tag in (TAG_VERSION, TAG_LEGACY_VERSION):
+        try:
+            bedrock.leveldb.get(db, chunk_key(chunk_x, chunk_z, dimension, tag))
+            return True
+        except KeyError:
+            pass
+    return False
 
 
-def scan(
+def read_subchunks(db, dimension: int, chunk_x: int, chunk_z: int, subchunk_ys: list[int]) -> dict[int, bytes]:
+    """
+    Read the raw records for some of a chunk's subchunks, keyed by subchunk y;
+    seeks once per contiguous run of keys and reads forward
+    """
+    key_bytes = sorted(subchunk_y & 0xff for subchunk_y in subchunk_ys)
+    runs = []
+    for key_byte in key_bytes:
+        if runs and runs[-1][1] == key_byte:
+            runs[-1][1] = key_byte + 1
+        else:
+            runs.append([key_byte, key_byte + 1])
+
+    prefix = chunk_key(chunk_x, chunk_z, dimension, TAG_SUBCHUNK_PREFIX)
+    records = {}
+    for start, end in runs:
+        end_key = prefix + bytes((end, )) if end <= 0xff else chunk_key(chunk_x, chunk_z, dimension, TAG_SUBCHUNK_PREFIX + 1)
+        for key, data in bedrock.leveldb.iterate(db, prefix + bytes((start, )), end_key):
+            if len(key) == len(prefix) + 1:
+                records[struct.unpack_from('<b', key, len(prefix))[0]] = data
+    return dict(sorted(records.items()))
+
+
+def get_subchunk_ys(y_range: Tuple[int, int], stored: int = ALL_SUBCHUNKS) -> list[int]:
+    """
+    The subchunk ys covering y_range, clamped to the lowest and highest of them
+    in the `stored` bitmask (see ChunkPresence)
+    """
+    y_min, y_max = y_range
+    subchunk_ys = [
+        subchunk_y
+        for subchunk_y in range(y_min // CHUNK_SIZE, y_max // CHUNK_SIZE + 1)
+        if stored >> (subchunk_y - PRESENCE_MIN_SUBCHUNK_Y) & 1
+    ]
+    return list(range(subchunk_ys[0], subchunk_ys[-1] + 1)) if subchunk_ys else []
+
+
+def read_chunk(
+    db, dimension: int, chunk_x: int, chunk_z: int, y_range: Tuple[int, int], stored: int = ALL_SUBCHUNKS
+) -> dict[int, bytes]:
+    """
+    Read the raw subchunk records covering y_range for a single chunk, keyed by subchunk y
+
+    Only the subchunks in the `stored` bitmask (see get_stored_subchunks()) are read
+    """
+    return read_subchunks(db, dimension, chunk_x, chunk_z, get_subchunk_ys(y_range, stored))
+
+
+def read_block_entities(db, dimension: int, chunk_x: int, chunk_z: int) -> list[dict]:
+    """
+    The decoded block entities (chests, spawners, signs, ...) of a chunk; the
+    record is just one NBT compound after another
+    """
+    try:
+        data = bedrock.leveldb.get(db, chunk_key(chunk_x, chunk_z, dimension, TAG_BLOCK_ENTITY))
+    except KeyError:
+        return []
+    entities = []
+    offset = 0
+    while offset < len(data):
+        entity, offset = read_nbt(data, offset)
+        entities.append(entity)
+    return entities
+
+
+def describe_block_entity(entity: dict) -> Optional[str]:
+    """
+    A one line summary of what's in a block entity: a container's contents
+    (or its loot table if it's never been opened) or the mob a spawner spawns
+    """
+    if 'EntityIdentifier' in entity:
+        return entity['EntityIdentifier']
+    if 'LootTable' in entity:
+        return f'loot {entity["LootTable"]}'
+    if 'Items' in entity:
+        items = Counter()
+        for item in entity['Items']:
+            items[item.get('Name', '?')] += item.get('Count', 1)
+        return ', '.join(f'{count} {name}' for name, count in items.most_common()) or 'empty'
+    return None
+
+
+def sort_chunks_by_key(chunks: list[Tuple[int, int]], dimension: int) -> list[Tuple[int, int]]:
+    """
+    Sort (chunk_x, chunk_z) into the order their records are stored in, so
+    reading them goes through the db sequentially rather than jumping about
+    """
+    return sorted(chunks, key=lambda chunk: chunk_key(chunk[0], chunk[1], dimension, TAG_VERSION))
+
+
+class ScanStats:
+    """
+    Counters for a scan, plus (with --stats) the wall time spent in each phase
+
+    Timing is off by default; time() then hands back a do-nothing context
+    manager so the instrumentation costs next to nothing
+    """
+
+    def __init__(self, timing: bool = False):
+        self.timing = timing
+        self.counts = Counter()
+        self.seconds = Counter()
+
+    def time(self, phase: str):
+        return self._time(phase) if self.timing else contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def _time(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += time.perf_counter() - started
+
+    def update(self, other: 'ScanStats'):
+        self.counts.update(other.counts)
+        self.seconds.update(other.seconds)
+
+
+def iter_timed(iterable, stats: ScanStats, phase: str):
+    """
+    Pass through the items of iterable, timing how long each one takes to produce
+    """
+    iterator = iter(iterable)
+    while True:
+        with stats.time(phase):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
+
+
+class ChunkCache:
+    """
+    LRU of decoded subchunks keyed by (dimension, chunk_x, chunk_z, subchunk_y)
+    with a bounded memory budget; missing subchunks and chunks are cached too
+    """
+
+    # rough cost of the key, the OrderedDict slot and the SubChunk object itself
+    ENTRY_OVERHEAD = 250
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[Tuple[int, int, int, Optional[int]], Tuple[Union[SubChunk, int, None], int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Raises KeyError if key isn't cached
+        """
+        try:
+            value, _size = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value: Union[SubChunk, int, None]):
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        size = self.ENTRY_OVERHEAD + (value.nbytes if isinstance(value, SubChunk) else 0)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _key, (_value, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def describe(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = f'{self.hits / lookups:.0%}' if lookups else '-'
+        return (
+            f'{len(self.entries)} entries, {self.bytes / 2**20:.1f}/{self.max_bytes / 2**20:.0f}MB,'
+            f' {self.hits} hits, {self.misses} misses ({hit_rate} hit rate), {self.evictions} evictions'
+        )
+
+
+def get_stored_subchunks(
+    db,
     dimension: int,
-    center: int,
-    x_range: int,
-    y_range: int,
-    z_range: int,
-    max_dist: int,
-    world_path: Path,
-    optional_blocks_chosen: dict[BlockGroupType, bool]
+    chunk_x: int,
+    chunk_z: int,
+    presence: Optional['ChunkPresence'] = None,
+    cache: Optional[ChunkCache] = None,
+    stats: Optional[ScanStats] = None,
+) -> Optional[int]:
+    """
+    Bitmask of which of a chunk's subchunks are stored (see ChunkPresence), or
+    None if the chunk hasn't been generated
+    """
+    if presence is not None:
+        return presence.get_stored(chunk_x, chunk_z)
+    stats = stats or ScanStats()
+    key = (dimension, chunk_x, chunk_z, None)
+    if cache is not None:
+        try:
+            return cache.get(key)
+        except KeyError:
+            pass
+    with stats.time('read'):
+        stored = ALL_SUBCHUNKS if has_chunk(db, dimension, chunk_x, chunk_z) else None
+    if cache is not None:
+        cache.put(key, stored)
+    return stored
+
+
+def load_subchunks(
+    db,
+    dimension: int,
+    chunk_x: int,
+    chunk_z: int,
+    y_range: Tuple[int, int],
+    cache: Optional[ChunkCache] = None,
+    stats: Optional[ScanStats] = None,
+    stored: int = ALL_SUBCHUNKS,
+) -> dict[int, SubChunk]:
+    """
+    read_chunk(), but decoded and going via the cache (if any)
+    """
+    stats = stats or ScanStats()
+    if cache is None:
+        with stats.time('read'):
+            records = read_chunk(db, dimension, chunk_x, chunk_z, y_range, stored)
+        stats.counts['bytes_read'] += sum(len(data) for data in records.values())
+        with stats.time('palette'):
+            return {subchunk_y: SubChunk(data) for subchunk_y, data in records.items()}
+
+    subchunks = {}
+    missing = []
+    for subchunk_y in get_subchunk_ys(y_range, stored):
+        try:
+            subchunk = cache.get((dimension, chunk_x, chunk_z, subchunk_y))
+        except KeyError:
+            missing.append(subchunk_y)
+            continue
+        if subchunk is not None:
+            subchunks[subchunk_y] = subchunk
+
+    if missing:
+        with stats.time('read'):
+            records = read_subchunks(db, dimension, chunk_x, chunk_z, missing)
+        stats.counts['bytes_read'] += sum(len(data) for data in records.values())
+        for subchunk_y in missing:
+            subchunk = None
+            if subchunk_y in records:
+                with stats.time('palette'):
+                    subchunk = subchunks[subchunk_y] = SubChunk(records[subchunk_y])
+            cache.put((dimension, chunk_x, chunk_z, subchunk_y), subchunk)
+    return dict(sorted(subchunks.items()))
+
+
+def iter_chunk_rings(
+    center: Coords,
+    x_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    only=None,
 ):
+    """
+    Yield (ring, chunks) for every chunk overlapping x_range/z_range (and in
+    `only`, if given), working outwards from the chunk containing center one
+    ring at a time
+    """
+    center_x, _center_y, center_z = center
+    x_min, x_max = x_range
+    z_min, z_max = z_range
+    center_chunk_x = center_x // CHUNK_SIZE
+    center_chunk_z = center_z // CHUNK_SIZE
+    chunks_x = range(x_min // CHUNK_SIZE, x_max // CHUNK_SIZE + 1)
+    chunks_z = range(z_min // CHUNK_SIZE, z_max // CHUNK_SIZE + 1)
+    if not chunks_x or not chunks_z:
+        return
+
+    max_ring = max(
+        abs(chunks_x[0] - center_chunk_x),
+        abs(chunks_x[-1] - center_chunk_x),
+        abs(chunks_z[0] - center_chunk_z),
+        abs(chunks_z[-1] - center_chunk_z),
+    )
+    for ring in range(0, max_ring+1):
+        chunks = [
+            (chunk_x, chunk_z)
+            for chunk_x in chunks_x
+            for chunk_z in chunks_z
+            if max(abs(chunk_x - center_chunk_x), abs(chunk_z - center_chunk_z)) == ring
+            and (only is None or (chunk_x, chunk_z) in only)
+        ]
+        if chunks:
+            yield ring, chunks
+
+
+# palette classifications
+BLOCK_IGNORE = 0
+BLOCK_INTERESTING = 1
+BLOCK_UNRECOGNISED = 2
+
+
+class BlockClassifier:
+    """
+    An (interesting, ignore) pair of block sets compiled down to a table of
+    BLOCK_* classes indexed by interned block id
+    """
+
+    def __init__(self, interesting_blocks: frozenset[BlockType], ignore_blocks: frozenset[BlockType]):
+        self.interesting_blocks = interesting_blocks
+        self.ignore_blocks = ignore_blocks
+        self.classes = np.empty(0, dtype=np.uint8)
+
+    def __reduce__(self):
+        return compile_blocks, (self.interesting_blocks, self.ignore_blocks)
+
+    def classify(self, block_ids: np.ndarray) -> np.ndarray:
+        """
+        The BLOCK_* class of each id; when given a palette's ids this can then be
+        used as a lookup table to classify a whole array of palette indices at once
+        """
+        if len(self.classes) < len(BLOCKS):
+            self.classes = np.concatenate((self.classes, np.array(
+                [
+                    BLOCK_IGNORE if info.name in self.ignore_blocks else
+                    BLOCK_INTERESTING if info.name in self.interesting_blocks else
+                    BLOCK_UNRECOGNISED
+                    for info in BLOCKS[len(self.classes):]
+                ],
+                dtype=np.uint8,
+            )))
+        return self.classes[block_ids]
+
+
+@functools.lru_cache(maxsize=None)
+def compile_blocks(interesting_blocks: frozenset[BlockType], ignore_blocks: frozenset[BlockType]) -> BlockClassifier:
+    return BlockClassifier(interesting_blocks, ignore_blocks)
+
+
+def merge_hits(hits: Hits, other: Hits):
+    for name, coords in other.items():
+        hits[name] += coords
+
+
+def canonical_name(name: BlockType) -> BlockType:
+    # deepslate ores are reported along with their regular counterparts
+    if name.startswith('minecraft:deepslate_'):
+        name = name[:len('minecraft:')] + name[len('minecraft:deepslate_'):]
+    return name
+
+
+def get_dists(coords: np.ndarray, center: Coords, metric='MANHATTAN_ADJUSTED') -> np.ndarray:
+    """
+    Distance from center for each row of an (N, 3) x,y,z array
+    """
+    delta = np.abs(coords.astype(np.int64) - center)
+    dx, dy, dz = delta[:, 0], delta[:, 1], delta[:, 2]
+
+    if metric == 'MANHATTAN':
+        return dx + dy + dz
+
+    if metric == 'MANHATTAN_ADJUSTED':
+        # a horizontal traversal requires 2 blocks
+        # but vertical usually requires at least 3 blocks (on average a bit more)
+        return (dx*2 + dy*3.25 + dz*2)/2
+
+    if metric == 'EUCLIDEAN':
+        return np.rint(np.sqrt(dx*dx + dy*dy + dz*dz)).astype(np.int64)
+
+    raise Exception(f'Unknown distance metric {metric}')
+
+
+def get_chunk_dist_bounds(
+    chunks: list[Tuple[int, int]],
+    center: Coords,
+    x_range: Tuple[int, int],
+    y_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    metric='MANHATTAN_ADJUSTED',
+) -> np.ndarray:
+    """
+    Lower bound on get_dists() for any block in each (chunk_x, chunk_z) that's
+    within the given (inclusive) ranges
+    """
     center_x, center_y, center_z = center
     x_min, x_max = x_range
     y_min, y_max = y_range
     z_min, z_max = z_range
-    found_grouped: dict[BlockType, dict[Coords, int]] = defaultdict(lambda: defaultdict(lambda: 0))
-    found_with_dist: dict[BlockType, list[DistCoords]] = defaultdict(list)
+    chunks = np.array(chunks, dtype=np.int64).reshape(-1, 2)
+    base_x = chunks[:, 0] * CHUNK_SIZE
+    base_z = chunks[:, 1] * CHUNK_SIZE
+    closest = np.column_stack((
+        np.clip(center_x, np.maximum(base_x, x_min), np.minimum(base_x + CHUNK_SIZE - 1, x_max)),
+        np.full(len(chunks), min(max(center_y, y_min), y_max)),
+        np.clip(center_z, np.maximum(base_z, z_min), np.minimum(base_z + CHUNK_SIZE - 1, z_max)),
+    ))
+    return get_dists(closest, center, metric)
 
-    interesting_blocks = INTERESTING.copy()
-    ignore_blocks = IGNORE.copy()
-    for key, value in optional_blocks_chosen.items():
-        blocks = OPTIONAL_BLOCKS[key]
-        if isinstance(blocks, str):
-            blocks = (blocks,)
-        for block in blocks:
-            if value:
-                interesting_blocks.add(block)
-            else:
-                ignore_blocks.add(block)
-
-    def get_dist(x: int, y: int, z: int, metric='MANHATTAN_ADJUSTED') -> float:
-        dx = x - center_x
-        dy = y - center_y
-        dz = z - center_z
-
-        if metric == 'MANHATTAN':
-            return abs(dx) + abs(dy) + abs(dz)
-
-        if metric == 'MANHATTAN_ADJUSTED':
-            # a horizontal traversal requires 2 blocks
-            # but vertical usually requires at least 3 blocks (on average a bit more)
-            return (abs(dx)*2 + abs(dy)*3.25 + abs(dz)*2)/2
-
-        if metric == 'EUCLIDEAN':
-            return round((dx*dx + dy*dy + dz*dz) ** 0.5)
-
-        raise Exception(f'Unknown distance metric {metric}')
-
-    def add_interesting(x: int, y: int, z: int, name: BlockType, dv: str):
-        if name.startswith('minecraft:deepslate_'):
-            name = name[:len('minecraft:')] + name[len('minecraft:deepslate_'):]
-        found_with_dist[name].append((get_dist(x, y, z), x, y, z))
-        ROUND = 1
-        x = x - (x % ROUND)
-        y = y - (y % ROUND)
-        z = z - (z % ROUND)
-        found_grouped[name][(x, y, z)] += 1
-        #print(found_with_dist[name])
-
-#    seen = set()
-
-    with bedrock.World(world_path) as world:
-        for dist in range(0, max_dist+1):
-            logger.info(f'Dist {dist}')
-            if dist == 0:
-                coords = ((center_x, center_z), )
-            else:
-                top = []
-                bottom = []
-                left = []
-                right = []
-
-                z_top = center_z - dist
-                top = \
-                    ((x, z_top) for x in range(
-                        max(center_x-dist, x_min),
-                        min(center_x+dist+1, x_max+1),
-                    )) if z_top >= z_min else []
-
-                z_bottom = center_z + dist
-                bottom = \
-                    ((x, z_bottom) for x in range(
-                        max(center_x-dist, x_min),
-                        min(center_x+dist+1, x_max+1),
-                    )) if z_bottom <= z_max else []
-
-                x_left = center_x - dist
-                left = \
-                    ((x_left, z) for z in range(
-                        max(center_z-dist+1, z_min),
-                        min(center_z+dist+1-1, z_max+1),
-                    )) if x_left >= x_min else []
-
-                x_right = center_x + dist
-                right = \
-                    ((x_right, z) for z in range(
-                        max(center_z-dist+1, z_min),
-                        min(center_z+dist+1-1, z_max+1),
-                    )) if x_right <= x_max else []
-
-                coords = itertools.chain(top, bottom, left, right)
-
-            for x, z in coords:
-                logger.debug(f'  Check {x:4},    *, {z:4}')
-#                assert (x,z) not in seen
-#                seen.add((x,z))
-                for y in range(y_min, y_max+1):
-#                    logger.debug(f'        {x:4}, {y:4}, {z:4}')
-                    block = world.getBlock(x, y, z, dimension=dimension)
 
-                    if block is None:
-                        #print(f'  block {block}')
-                        continue
+def ring_order_keys(coords: np.ndarray, center: Coords) -> Tuple[np.ndarray, ...]:
+    """
+    Sort keys (most significant first) giving the order the original column by
+    column ring traversal would have visited each block of an (N, 3) x,y,z
+    array in: ring, then side (top, bottom, left, right), then position along
+    that side, then y
+    """
+    center_x, _center_y, center_z = center
+    x, y, z = coords[:, 0], coords[:, 1], coords[:, 2]
+    dx = x - center_x
+    dz = z - center_z
+    ring = np.maximum(np.abs(dx), np.abs(dz))
+    side = np.select([dz == -ring, dz == ring, dx == -ring], [0, 1, 2], 3)
+    position = np.where(side < 2, x, z)
+    return ring, side, position, y
 
-                    name = block.name
-                    #print(f'  block {name}')
-                    if name in ignore_blocks:
-                        continue
 
-                    dv = DV_LOOKUPS[block.name][block.dv] if block.name in DV_LOOKUPS else None
-                    #print(f'    dv {dv}')
-                    if name in interesting_blocks:
-                        add_interesting(x, y, z, name, dv)
-#                        print(name, dv)
-                    else:
-                        logger.error(f'Unrecognised block {name}/{dv}')
-#                        print(name, dv)
-                        if block.nbt is not None:
-                            logger.error(x, y, z, block.name, block.nbt)
-#                            raise Exception(f'Found an NBT at {x},{y},{z}')
-
-    '''
-    for z in range(100-2, 100+2+1):
-        for x in range(100-2, 100+2+1):
-            if (x, z) == (center_x, center_y):
-                symbol = 'o'
-            elif (x, z) in seen:
-                symbol = 'x'
-            else:
-                symbol = '.'
-            print(symbol, end='')
-        print("\n")
-    '''
+# ---------------------------------------------------------------------------
+# Query shapes
+#
+# A query is always an axis aligned box, but can be narrowed further to a
+# shape within it. Each shape describes itself as the range of y it covers in
+# each x,z column, which is all that's needed to cull the chunks it misses
+# before reading anything, to only read the subchunks it reaches in the rest,
+# and to clip the hits to it exactly
 
-    return found_grouped, found_with_dist
 
-def show_interesting_text(
-    found_grouped: dict[BlockType, dict[Coords, int]],
-    found_with_dist: dict[BlockType, list[DistCoords]],
-):
-    for name in sorted(found_with_dist.keys()):
-        total = len(found_with_dist[name])
-        print('------------------------------------------------------------------------')
-        print('TOTAL', name, total)
-        for dist, x, y, z in sorted(found_with_dist[name]):
-            print(name, f'{dist:6} ({x:4} {y:4} {z:4})')
+class QueryShape:
+    """
+    A region to search, in block coordinates
+    """
 
-def show_interesting_text_closest(
-    found_grouped: dict[BlockType, dict[Coords, int]],
-    found_with_dist: dict[BlockType, list[DistCoords]],
-):
-    merged_list = []
-    for name in sorted(found_with_dist.keys()):
-        merged_list += [ (dist, name, x, y, z) for dist, x, y, z in found_with_dist[name] ]
-    merged_list.sort()
+    def get_bounds(self) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        The (inclusive) x and z ranges of the box around the shape
+        """
+        raise NotImplementedError
 
-    total = len(merged_list)
-    print('------------------------------------------------------------------------')
-    print('TOTAL', total)
-    for dist, name, x, y, z in merged_list:
-        print(name, dist, '(', x, y, z, ')')
+    def get_y_bounds(self) -> Optional[Tuple[int, int]]:
+        """
+        The (inclusive) y range of the shape, or None if it has no height of its
+        own (in which case the query's y range is its height)
+        """
+        return None
 
+    def may_reach(self, x_range: Tuple[int, int], z_min: np.ndarray, z_max: np.ndarray) -> np.ndarray:
+        """
+        Quick conservative test of whether the shape might reach each of the
+        boxes spanning x_range and z_min to z_max (inclusive), used to skip
+        whole chunks before looking at their columns
+        """
+        return np.ones(len(z_min), dtype=bool)
 
-def show_interesting_json(
-    found_grouped: dict[BlockType, dict[Coords, int]],
-    found_with_dist: dict[BlockType, list[DistCoords]],
-):
-    data = {}
-    for block_name, coords_count in found_grouped.items():
-        if block_name not in data:
-            data[block_name] = {}
-        for (x,y,z), count in coords_count.items():
-            if f"{x},{z}" not in data[block_name]:
-                data[block_name][f"{x},{z}"] = []
-            data[block_name][f"{x},{z}"].append(y)
-    print(json.dumps(data, indent=None))
-    
+    def get_column_y_ranges(self, x: np.ndarray, z: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The lowest and highest y of the shape in each x,z column (x and z are
+        broadcast together); where a column misses the shape entirely the lowest
+        is above the highest
+        """
+        raise NotImplementedError
 
-def parse():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('center_x', type=str)
-    parser.add_argument('center_y', type=str)
-    parser.add_argument('center_z', type=str)
-    parser.add_argument('--ymin', type=int, default=None)
-    parser.add_argument('--ymax', type=int, default=None)
-    parser.add_argument('--dist', type=int, default=DEFAULT_MAX_DIST)
-    parser.add_argument('--world', type=Path, default=DEFAULT_WORLD_PATH)
-    parser.add_argument('--verbose', '-v', action='count', default=0, dest='log_level')
-    parser.add_argument('--json', action='store_const', default='text', const='json', dest='format')
-    parser.add_argument('--closest', action='store_const', default='text', const='text_closest', dest='format')
-    parser.add_argument('--up', action='store_true')
-    parser.add_argument('--down', action='store_true')
-    parser.add_argument('--ydist', type=int, default=None)
-    parser.add_argument('--north', action='store_true')
-    parser.add_argument('--south', action='store_true')
-    parser.add_argument('--east', action='store_true')
-    parser.add_argument('--west', action='store_true')
-    parser.add_argument('--nether', action='store_const', const=1, dest='dimension', default=0)
-    parser.add_argument('--theend', action='store_const', const=2, dest='dimension')
-    parser.add_argument('--debug', type=str, default=None)
+    def contains(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Whether each row of an (N, 3) x,y,z array is inside the shape
+        """
+        y_min, y_max = self.get_column_y_ranges(coords[:, 0], coords[:, 2])
+        y = coords[:, 1]
+        return (y >= y_min) & (y <= y_max)
 
-    for opt in OPTIONAL_BLOCKS:
-        parser.add_argument(f'--{opt}', default=False, action='store_true')
+    @staticmethod
+    def get_half_heights(radius, dist_squared) -> np.ndarray:
+        """
+        How far above and below its middle a ball (or round tunnel) of radius
+        reaches at a horizontal distance from its middle; -1 where that's outside it
+        """
+        inside = dist_squared <= radius * radius
+        return np.where(inside, np.sqrt(np.where(inside, radius * radius - dist_squared, 0)), -1.0)
 
-    opts = parser.parse_args(sys.argv[1:])
-    opts.center_x = int(opts.center_x.rstrip(','))
-    opts.center_y = int(opts.center_y.rstrip(','))
-    opts.center_z = int(opts.center_z.rstrip(','))
 
-    if opts.east and opts.west:
-        raise Exception('--east and --west are mutually exclusive')
-    if opts.north and opts.south:
-        raise Exception('--north and --south are mutually exclusive')
+class SphereShape(QueryShape):
+    """
+    Every block within radius (euclidean) of center
+    """
 
-    ymax_candidates = [
-        opts.ymax,
-        opts.center_y if opts.down else None,
-        opts.center_y + opts.ydist if opts.ydist is not None else None,
-        max(DEFAULT_Y_MAX, opts.center_y + DEFAULT_Y_DIST)
-    ]
-    opts.ymax = next(y for y in ymax_candidates if y is not None)
-    opts.ymax = min(opts.ymax, Y_MAX)
+    def __init__(self, center: Coords, radius: float):
+        self.center = center
+        self.radius = radius
 
-    ymin_candidates = [
-        opts.ymin,
-        opts.center_y if opts.up else None,
-        opts.center_y - opts.ydist if opts.ydist is not None else None,
-        min(DEFAULT_Y_MIN, opts.center_y - DEFAULT_Y_DIST)
-    ]
-    opts.ymin = next(y for y in ymin_candidates if y is not None)
-    opts.ymin = max(Y_MIN, opts.ymin)
+    def __str__(self):
+        return f'sphere of radius {self.radius}'
 
-    return opts
+    def get_bounds(self):
+        center_x, _center_y, center_z = self.center
+        radius = math.floor(self.radius)
+        return (center_x - radius, center_x + radius), (center_z - radius, center_z + radius)
 
-def show_age(world_path: Path):
-    # reading the dir is not good because the act of opening the file
-    # sets a new modified timestamp
-    #world_db = Path(world_path, 'db')
-    #now = datetime.now()
-    #smallest_delta = None
-    #for f in world_db.iterdir():
-    #    if not f.is_file():
-    #        continue
-    #    t = datetime.fromtimestamp(f.stat().st_mtime)
-    #    delta = now - t
-    #    smallest_delta = delta if smallest_delta is None else min(smallest_delta, delta)
+    def get_y_bounds(self):
+        center_y = self.center[1]
+        radius = math.floor(self.radius)
+        return center_y - radius, center_y + radius
 
-    smallest_delta = datetime.now() - datetime.fromtimestamp((world_path / 'last_updated').stat().st_mtime)
-    print('Last updated:', humanize.precisedelta(smallest_delta))
-    
+    def may_reach(self, x_range, z_min, z_max):
+        return get_box_dists_squared(self.center, x_range, z_min, z_max) <= self.radius * self.radius
 
-def run():
-    opts = parse()
-    global logger
-    logger = init_logger(opts.log_level)
+    def get_column_y_ranges(self, x, z):
+        center_x, center_y, center_z = self.center
+        dx = np.asarray(x, dtype=np.float64) - center_x
+        dz = np.asarray(z, dtype=np.float64) - center_z
+        half_height = self.get_half_heights(self.radius, dx * dx + dz * dz)
+        return center_y - half_height, center_y + half_height
 
-    if opts.debug:
-        if len(opts.debug.split(':') < 2):
-            opts.debug += ':58400'
 
-        debug_host, debug_port = opts.debug.split(':')
+class CylinderShape(QueryShape):
+    """
+    Every block within radius of center horizontally, at any y (so the query's
+    y range is the height of the cylinder)
+    """
 
-        import pydevd_pycharm
-        pydevd_pycharm.settrace(
-            debug_host,
-            port=debug_port,
-            stdoutToServer=True,
-            stderrToServer=True
+    def __init__(self, center: Coords, radius: float):
+        self.center = center
+        self.radius = radius
+
+    def __str__(self):
+        return f'cylinder of radius {self.radius}'
+
+    def get_bounds(self):
+        center_x, _center_y, center_z = self.center
+        radius = math.floor(self.radius)
+        return (center_x - radius, center_x + radius), (center_z - radius, center_z + radius)
+
+    def may_reach(self, x_range, z_min, z_max):
+        return get_box_dists_squared(self.center, x_range, z_min, z_max) <= self.radius * self.radius
+
+    def get_column_y_ranges(self, x, z):
+        center_x, _center_y, center_z = self.center
+        dx = np.asarray(x, dtype=np.float64) - center_x
+        dz = np.asarray(z, dtype=np.float64) - center_z
+        inside = dx * dx + dz * dz <= self.radius * self.radius
+        return np.where(inside, -np.inf, np.inf), np.where(inside, np.inf, -np.inf)
+
+
+class TunnelShape(QueryShape):
+    """
+    A round, level tunnel of `width` along a heading (degrees clockwise from
+    north) for `length` blocks; with end_width it's a cone
+    """
+
+    def __init__(self, center: Coords, heading: float, length: float, width: float, end_width: Optional[float] = None):
+        self.center = center
+        self.heading = heading
+        self.length = length
+        self.width = width
+        self.end_width = width if end_width is None else end_width
+        # north is -z
+        self.direction = (math.sin(math.radians(heading)), -math.cos(math.radians(heading)))
+
+    def __str__(self):
+        widths = f'{self.width}' if self.end_width == self.width else f'{self.width} to {self.end_width}'
+        return f'tunnel heading {self.heading} for {self.length}, {widths} wide'
+
+    def get_bounds(self):
+        center_x, _center_y, center_z = self.center
+        direction_x, direction_z = self.direction
+        end_x = center_x + direction_x * self.length
+        end_z = center_z + direction_z * self.length
+        radius = max(self.width, self.end_width) / 2
+        return (
+            (math.ceil(min(center_x, end_x) - radius), math.floor(max(center_x, end_x) + radius)),
+            (math.ceil(min(center_z, end_z) - radius), math.floor(max(center_z, end_z) + radius)),
         )
 
-    show_age(Path(opts.world))
+    def get_y_bounds(self):
+        center_y = self.center[1]
+        radius = math.floor(max(self.width, self.end_width) / 2)
+        return center_y - radius, center_y + radius
 
-    x_min = opts.center_x - (opts.dist if not opts.east else 0)
-    x_max = opts.center_x + (opts.dist if not opts.west else 0)
-    z_min = opts.center_z - (opts.dist if not opts.south else 0)
-    z_max = opts.center_z + (opts.dist if not opts.north else 0)
+    def may_reach(self, x_range, z_min, z_max):
+        # the distance from the middle of each box to the tunnel's centre line
+        center_x, _center_y, center_z = self.center
+        direction_x, direction_z = self.direction
+        dx = (x_range[0] + x_range[1]) / 2 - center_x
+        dz = (np.asarray(z_min) + np.asarray(z_max)) / 2 - center_z
+        along = np.clip(dx * direction_x + dz * direction_z, 0, self.length)
+        dist = np.hypot(dx - along * direction_x, dz - along * direction_z)
+        half_diagonal = np.hypot(x_range[1] - x_range[0], np.asarray(z_max) - np.asarray(z_min)) / 2
+        return dist <= max(self.width, self.end_width) / 2 + half_diagonal
 
-    logger.info('Searching'
-       f' [{x_min}-{x_max}]'
-       f' [{opts.ymin}-{opts.ymax}]'
-       f' [{z_min}-{z_max}]'
-       )
+    def get_column_y_ranges(self, x, z):
+        center_x, center_y, center_z = self.center
+        direction_x, direction_z = self.direction
+        dx = np.asarray(x, dtype=np.float64) - center_x
+        dz = np.asarray(z, dtype=np.float64) - center_z
+        along = dx * direction_x + dz * direction_z
+        across = dx * direction_z - dz * direction_x
+        radius = (self.width + (self.end_width - self.width) * np.clip(along / self.length, 0, 1)) / 2
+        half_height = np.where((along >= 0) & (along <= self.length), self.get_half_heights(radius, across * across), -1.0)
+        return center_y - half_height, center_y + half_height
 
-    found_grouped, found_with_dist = scan(
-        dimension=opts.dimension,
-        center=(opts.center_x, opts.center_y, opts.center_z),
-        x_range=(x_min, x_max),
-        y_range=(opts.ymin, opts.ymax),
-        z_range=(z_min, z_max),
-        max_dist=opts.dist,
-        world_path=opts.world,
-        optional_blocks_chosen={ key: getattr(opts, key) for key in OPTIONAL_BLOCKS },
-    )
-    show_fns = {
-        'text': show_interesting_text,
-        'text_closest': show_interesting_text_closest,
-        'json': show_interesting_json,
-    }
-    show_fns[opts.format](found_grouped, found_with_dist)
+
+class PolygonShape(QueryShape):
+    """
+    A vertical prism: every block whose x,z is inside (or on the edge of) a
+    polygon given as its corners in order, at any y
+    """
+
+    def __init__(self, corners: list[Tuple[int, int]]):
+        self.corners = [tuple(corner) for corner in corners]
+
+    def __str__(self):
+        return f'polygon {" ".join(f"{x},{z}" for x, z in self.corners)}'
+
+    def get_bounds(self):
+        xs = [x for x, _z in self.corners]
+        zs = [z for _x, z in self.corners]
+        return (min(xs), max(xs)), (min(zs), max(zs))
+
+    def get_column_y_ranges(self, x, z):
+        x, z = np.broadcast_arrays(np.asarray(x, dtype=np.int64), np.asarray(z, dtype=np.int64))
+        inside = np.zeros(x.shape, dtype=bool)
+        on_edge = np.zeros(x.shape, dtype=bool)
+        for (x1, z1), (x2, z2) in zip(self.corners, self.corners[1:] + self.corners[:1]):
+            # even-odd rule, counting the edges crossed by a ray towards +x
+            crosses = (z1 > z) != (z2 > z)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inside ^= crosses & (x < x1 + (z - z1) * (x2 - x1) / (z2 - z1))
+            on_edge |= (
+                ((x2 - x1) * (z - z1) == (z2 - z1) * (x - x1))
+                & (x >= min(x1, x2)) & (x <= max(x1, x2))
+                & (z >= min(z1, z2)) & (z <= max(z1, z2))
+            )
+        inside |= on_edge
+        return np.where(inside, -np.inf, np.inf), np.where(inside, np.inf, -np.inf)
+
+
+def get_box_dists_squared(center: Coords, x_range: Tuple[int, int], z_min: np.ndarray, z_max: np.ndarray) -> np.ndarray:
+    """
+    Squared horizontal distance from center to the closest point of each box
+    spanning x_range and z_min to z_max
+    """
+    center_x, _center_y, center_z = center
+    dx = min(max(center_x, x_range[0]), x_range[1]) - center_x
+    dz = np.clip(center_z, z_min, z_max) - center_z
+    return dx * dx + dz * dz
+
+
+def get_chunk_y_ranges(
+    x_range: Tuple[int, int],
+    y_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    shape: Optional[QueryShape] = None,
+) -> dict[Tuple[int, int], Tuple[int, int]]:
+    """
+    The (inclusive) y range to read from each (chunk_x, chunk_z) overlapping the
+    given (inclusive) ranges and the shape (if any)
+    """
+    x_min, x_max = x_range
+    y_min, y_max = y_range
+    z_min, z_max = z_range
+    if shape is None:
+        return {
+            (chunk_x, chunk_z): y_range
+            for chunk_x in range(x_min // CHUNK_SIZE, x_max // CHUNK_SIZE + 1)
+            for chunk_z in range(z_min // CHUNK_SIZE, z_max // CHUNK_SIZE + 1)
+        }
+    if x_min > x_max or z_min > z_max:
+        return {}
+
+    chunk_y_ranges = {}
+    chunk_zs = np.arange(z_min // CHUNK_SIZE, z_max // CHUNK_SIZE + 1)
+    chunk_z_mins = np.maximum(chunk_zs * CHUNK_SIZE, z_min)
+    chunk_z_maxs = np.minimum(chunk_zs * CHUNK_SIZE + CHUNK_SIZE - 1, z_max)
+    # a row of chunks at a time, so memory doesn't grow with the area of the shape
+    for chunk_x in range(x_min // CHUNK_SIZE, x_max // CHUNK_SIZE + 1):
+        x = np.arange(max(x_min, chunk_x * CHUNK_SIZE), min(x_max, chunk_x * CHUNK_SIZE + CHUNK_SIZE - 1) + 1)
+        reached = shape.may_reach((int(x[0]), int(x[-1])), chunk_z_mins, chunk_z_maxs)
+        if not reached.any():
+            continue
+        row_chunk_zs = chunk_zs[reached]
+        z = np.concatenate([
+            np.arange(z_start, z_end + 1) for z_start, z_end in zip(chunk_z_mins[reached].tolist(), chunk_z_maxs[reached].tolist())
+        ])
+        column_y_min, column_y_max = shape.get_column_y_ranges(x[:, None], z[None, :])
+        column_y_min = np.maximum(np.ceil(column_y_min), y_min)
+        column_y_max = np.minimum(np.floor(column_y_max), y_max)
+        # the lowest and highest y in each z across the row, then in each chunk
+        in_shape = column_y_min <= column_y_max
+        z_y_min = np.where(in_shape, column_y_min, np.inf).min(axis=0)
+        z_y_max = np.where(in_shape, column_y_max, -np.inf).max(axis=0)
+        starts = np.flatnonzero(np.diff(z // CHUNK_SIZE, prepend=z[0] // CHUNK_SIZE - 1))
+        row_y_min = np.minimum.reduceat(z_y_min, starts)
+        row_y_max = np.maximum.reduceat(z_y_max, starts)
+        for chunk_z, chunk_y_min, chunk_y_max in zip(row_chunk_zs.tolist(), row_y_min.tolist(), row_y_max.tolist()):
+            if chunk_y_min <= chunk_y_max:
+                chunk_y_ranges[(chunk_x, chunk_z)] = (int(chunk_y_min), int(chunk_y_max))
+    return chunk_y_ranges
+
+
+def scan_chunk(
+    chunk_x: int,
+    chunk_z: int,
+    subchunks: dict[int, SubChunk],
+    x_range: Tuple[int, int],
+    y_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    classifier: BlockClassifier,
+    stats: ScanStats,
+    shape: Optional[QueryShape] = None,
+) -> Hits:
+    """
+    Find all interesting blocks in a single chunk (as returned by load_subchunks()),
+    clipped to the given (inclusive) ranges and to shape (if any)
+    """
+    x_min, x_max = x_range
+    y_min, y_max = y_range
+    z_min, z_max = z_range
+    base_x = chunk_x * CHUNK_SIZE
+    base_z = chunk_z * CHUNK_SIZE
+    x_slice = slice(max(x_min - base_x, 0), min(x_max - base_x, CHUNK_SIZE - 1) + 1)
+    z_slice = slice(max(z_min - base_z, 0), min(z_max - base_z, CHUNK_SIZE - 1) + 1)
+    columns = (x_slice.stop - x_slice.start) * (z_slice.stop - z_slice.start)
+    counts = stats.counts
+    counts['chunks'] += 1
+    counts['columns'] += columns
+
+    hits: Hits = defaultdict(list)
+    for subchunk_y, subchunk in subchunks.items():
+        base_y = subchunk_y * CHUNK_SIZE
+        y_slice = slice(max(y_min - base_y, 0), min(y_max - base_y, CHUNK_SIZE - 1) + 1)
+        counts['subchunks'] += 1
+        counts['blocks'] += columns * (y_slice.stop - y_slice.start)
+
+        # anything not ignored is either interesting or unrecognised (and
+        # needs reporting); if there's none of either then there's no need
+        # to even unpack the block storage
+        with stats.time('classify'):
+            palette_classes = classifier.classify(subchunk.palette_ids)
+        if not palette_classes.any():
+            counts['subchunks_skipped'] += 1
+            continue
+
+        with stats.time('unpack'):
+            blocks = subchunk.blocks[x_slice, z_slice, y_slice]
+
+        with stats.time('classify'):
+            for palette_index in np.flatnonzero(palette_classes == BLOCK_UNRECOGNISED):
+                name, dv = subchunk.palette[palette_index]
+                for _ in range(np.count_nonzero(blocks == palette_index)):
+                    counts['unrecognised'] += 1
+                    logger.error(f'Unrecognised block {name}/{dv}')
+
+            x, z, y = np.nonzero(palette_classes[blocks] == BLOCK_INTERESTING)
+            if not len(x):
+                continue
+            coords = np.column_stack((
+                x + (base_x + x_slice.start),
+                y + (base_y + y_slice.start),
+                z + (base_z + z_slice.start),
+            )).astype(np.int32)
+            palette_indices = blocks[x, z, y]
+            if shape is not None:
+                inside = shape.contains(coords)
+                coords, palette_indices = coords[inside], palette_indices[inside]
+            for palette_index in np.unique(palette_indices):
+                block = BLOCKS[subchunk.palette_ids[palette_index]]
+                hits[block.canonical].append(coords[palette_indices == palette_index])
+
+    return hits
+
+
+def init_worker(log_level: int):
+    global logger
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    logger = logging.getLogger('mc-scan')
+
+
+def scan_tile(
+    chunks: list[Tuple[int, int, Tuple[int, int], dict[int, bytes]]],
+    x_range: Tuple[int, int],
+    y_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    classifier: BlockClassifier,
+    timing: bool,
+    shape: Optional[QueryShape] = None,
+) -> Tuple[Hits, ScanStats]:
+    """
+    Worker process entry point: scan_chunk() every chunk in a tile
+
+    Each chunk comes with the y range to scan it over (see get_chunk_y_ranges())
+    """
+    hits: Hits = defaultdict(list)
+    stats = ScanStats(timing)
+    for chunk_x, chunk_z, y_range, records in chunks:
+        with stats.time('palette'):
+            subchunks = {subchunk_y: SubChunk(data) for subchunk_y, data in records.items()}
+        chunk_hits = scan_chunk(chunk_x, chunk_z, subchunks, x_range, y_range, z_range, classifier, stats, shape)
+        merge_hits(hits, chunk_hits)
+    return hits, stats
+
+
+def iter_prefetched(fn, items: Iterator, pool: concurrent_futures.Executor, depth: int) -> Iterator:
+    """
+    fn(item) for each of items, in order, with up to `depth` of them running on
+    pool ahead of the one being consumed
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) > depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_world_hits(
+    world_path: Path,
+    dimension: int,
+    center: Coords,
+    x_range: Tuple[int, int],
+    y_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    classifier: BlockClassifier,
+    jobs: int,
+    stats: ScanStats,
+    db=None,
+    cache: Optional[ChunkCache] = None,
+    key_order: bool = False,
+    presence: Optional['ChunkPresence'] = None,
+    prefetch: int = 0,
+    shape: Optional[QueryShape] = None,
+) -> Iterator[Hits]:
+    """
+    Read every chunk in the given (inclusive) ranges from leveldb and scan_chunk() it,
+    yielding the hits from each chunk (or tile, with jobs) in ring order, or key
+    order if key_order is set
+
+    If db isn't given the world is opened (and closed again) just for this scan
+    """
+    chunk_y_ranges = get_chunk_y_ranges(x_range, y_range, z_range, shape)
+    rings = iter_chunk_rings(center, x_range, z_range, chunk_y_ranges)
+    if key_order:
+        rings = [('all', sort_chunks_by_key([chunk for _ring, chunks in rings for chunk in chunks], dimension))]
+
+    with open_world_db(world_path) if db is None else contextlib.nullcontext(db) as db:
+        if jobs > 1:
+            # leveldb only allows one process to have the db open so the reads
+            # all happen here and the decoding is farmed out to the workers
+            tiles = defaultdict(list)
+            for _ring, chunks in rings:
+                for chunk_x, chunk_z in chunks:
+                    tiles[(chunk_x // TILE_CHUNKS, chunk_z // TILE_CHUNKS)].append((chunk_x, chunk_z))
+
+            def collect(futures):
+                for future in futures:
+                    tile_hits, tile_stats = future.result()
+                    stats.update(tile_stats)
+                    yield tile_hits
+
+            with concurrent_futures.ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=init_worker,
+                initargs=(logger.getEffectiveLevel(), ),
+            ) as pool:
+                pending = set()
+                for tile_number, tile in enumerate(tiles.values(), start=1):
+                    logger.info(f'Tile {tile_number}/{len(tiles)}')
+                    records = []
+                    for chunk_x, chunk_z in tile:
+                        stored = get_stored_subchunks(db, dimension, chunk_x, chunk_z, presence, stats=stats)
+                        if stored is None:
+                            stats.counts['chunks_ungenerated'] += 1
+                            continue
+                        chunk_y_range = chunk_y_ranges[(chunk_x, chunk_z)]
+                        with stats.time('read'):
+                            chunk = read_chunk(db, dimension, chunk_x, chunk_z, chunk_y_range, stored)
+                        records.append((chunk_x, chunk_z, chunk_y_range, chunk))
+                    stats.counts['bytes_read'] += sum(len(data) for _x, _z, _y_range, chunk in records for data in chunk.values())
+                    pending.add(pool.submit(
+                        scan_tile, records, x_range, y_range, z_range, classifier, stats.timing, shape
+                    ))
+                    # don't read the whole world into memory if the workers fall behind
+                    if len(pending) >= jobs * 2:
+                        done, pending = concurrent_futures.wait(pending, return_when=concurrent_futures.FIRST_COMPLETED)
+                        yield from collect(done)
+                yield from collect(concurrent_futures.as_completed(pending))
+        elif prefetch > 0:
+            # the cache isn't thread safe, so it's only looked up (as chunks are
+            # queued) and filled in (as they're scanned) on this thread; the read
+            # and decode threads only ever see the cache misses
+            def lookup(ring, chunk_x, chunk_z):
+                """
+                (ring, chunk_x, chunk_z, stored, cached subchunks, subchunk ys to read),
+                with None for the ys if the read thread has to check whether the chunk is stored
+                """
+                if presence is not None:
+                    stored = presence.get_stored(chunk_x, chunk_z)
+                elif cache is not None:
+                    try:
+                        stored = cache.get((dimension, chunk_x, chunk_z, None))
+                    except KeyError:
+                        return ring, chunk_x, chunk_z, None, {}, None
+                else:
+                    return ring, chunk_x, chunk_z, None, {}, None
+                if stored is None:
+                    return ring, chunk_x, chunk_z, None, {}, []
+                subchunk_ys = get_subchunk_ys(chunk_y_ranges[(chunk_x, chunk_z)], stored)
+                if cache is None:
+                    return ring, chunk_x, chunk_z, stored, {}, subchunk_ys
+                cached = {}
+                missing = []
+                for subchunk_y in subchunk_ys:
+                    try:
+                        subchunk = cache.get((dimension, chunk_x, chunk_z, subchunk_y))
+                    except KeyError:
+                        missing.append(subchunk_y)
+                        continue
+                    if subchunk is not None:
+                        cached[subchunk_y] = subchunk
+                return ring, chunk_x, chunk_z, stored, cached, missing
+
+            def read(item):
+                ring, chunk_x, chunk_z, stored, cached, missing = item
+                chunk_stats = ScanStats(timing=stats.timing)
+                checked = missing is None
+                if checked:
+                    stored = get_stored_subchunks(db, dimension, chunk_x, chunk_z, stats=chunk_stats)
+                    missing = [] if stored is None else get_subchunk_ys(chunk_y_ranges[(chunk_x, chunk_z)], stored)
+                records = {}
+                if missing:
+                    with chunk_stats.time('read'):
+                        records = read_subchunks(db, dimension, chunk_x, chunk_z, missing)
+                    chunk_stats.counts['bytes_read'] += sum(len(data) for data in records.values())
+                return ring, chunk_x, chunk_z, stored, checked, cached, missing, records, chunk_stats
+
+            def decode(item):
+                ring, chunk_x, chunk_z, stored, checked, cached, missing, records, chunk_stats = item
+                with chunk_stats.time('palette'):
+                    decoded = {subchunk_y: SubChunk(data) for subchunk_y, data in records.items()}
+                return ring, chunk_x, chunk_z, stored, checked, cached, missing, decoded, chunk_stats
+
+            items = (lookup(ring, chunk_x, chunk_z) for ring, chunks in rings for chunk_x, chunk_z in chunks)
+            # a single decode thread, as decoding interns any new block names
+            with concurrent_futures.ThreadPoolExecutor(max_workers=prefetch) as read_pool, \
+                    concurrent_futures.ThreadPoolExecutor(max_workers=1) as decode_pool:
+                current_ring = None
+                decoded = iter_prefetched(decode, iter_prefetched(read, items, read_pool, prefetch), decode_pool, prefetch)
+                for ring, chunk_x, chunk_z, stored, checked, cached, missing, subchunks, chunk_stats in decoded:
+                    if ring != current_ring:
+                        logger.info(f'Chunk dist {ring}')
+                        current_ring = ring
+                    stats.update(chunk_stats)
+                    if cache is not None:
+                        if checked:
+                            cache.put((dimension, chunk_x, chunk_z, None), stored)
+                            # the subchunks were read without looking them up, as load_subchunks() would have missed
+                            cache.misses += len(missing)
+                        for subchunk_y in missing:
+                            cache.put((dimension, chunk_x, chunk_z, subchunk_y), subchunks.get(subchunk_y))
+                    if stored is None:
+                        stats.counts['chunks_ungenerated'] += 1
+                        continue
+                    yield scan_chunk(
+                        chunk_x=chunk_x,
+                        chunk_z=chunk_z,
+                        subchunks=dict(sorted({**cached, **subchunks}.items())),
+                        x_range=x_range,
+                        y_range=chunk_y_ranges[(chunk_x, chunk_z)],
+                        z_range=z_range,
+                        classifier=classifier,
+                        stats=stats,
+                        shape=shape,
+                    )
+        else:
+            for ring, chunks in rings:
+                logger.info(f'Chunk dist {ring}')
+                for chunk_x, chunk_z in chunks:
+                    logger.debug(f'  Check chunk {chunk_x:4}, {chunk_z:4}')
+                    stored = get_stored_subchunks(db, dimension, chunk_x, chunk_z, presence, cache, stats)
+                    if stored is None:
+                        stats.counts['chunks_ungenerated'] += 1
+                        continue
+                    chunk_y_range = chunk_y_ranges[(chunk_x, chunk_z)]
+                    yield scan_chunk(
+                        chunk_x=chunk_x,
+                        chunk_z=chunk_z,
+                        subchunks=load_subchunks(db, dimension, chunk_x, chunk_z, chunk_y_range, cache, stats, stored),
+                        x_range=x_range,
+                        y_range=chunk_y_range,
+                        z_range=z_range,
+                        classifier=classifier,
+                        stats=stats,
+                        shape=shape,
+                    )
+
+
+class NearestBlocks:
+    """
+    The `limit` closest hits seen so far, as a heap with the furthest on top;
+    ties go to the lowest x, y, z
+    """
+
+    def __init__(self, center: Coords, limit: int):
+        self.center = center
+        self.limit = limit
+        self.heap: list[Tuple[float, int, int, int, BlockType]] = []
+
+    @property
+    def full(self) -> bool:
+        return len(self.heap) >= self.limit
+
+    @property
+    def furthest(self) -> Optional[float]:
+        return -self.heap[0][0] if self.heap else None
+
+    def add(self, hits: Hits):
+        for name, coords_list in hits.items():
+            for coords in coords_list:
+                dists = get_dists(coords, self.center)
+                if self.full:
+                    # most hits are nowhere near close enough so don't bother
+                    # going through them one by one
+                    keep = dists <= self.furthest
+                    coords, dists = coords[keep], dists[keep]
+                for dist, (x, y, z) in zip(dists.tolist(), coords.tolist()):
+                    item = (-dist, -x, -y, -z, name)
+                    if not self.full:
+                        heapq.heappush(self.heap, item)
+                    elif item > self.heap[0]:
+                        heapq.heapreplace(self.heap, item)
+
+    def get_hits(self) -> Hits:
+        hits: Hits = defaultdict(list)
+        for _dist, x, y, z, name in self.heap:
+            hits[name].append(np.array([[-x, -y, -z]], dtype=np.int32))
+        return hits
+
+
+def scan_world_nearest(
+    world_path: Path,
+    dimension: int,
+    center: Coords,
+    x_range: Tuple[int, int],
+    y_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    classifier: BlockClassifier,
+    limit: int,
+    stats: ScanStats,
+    db=None,
+    cache: Optional[ChunkCache] = None,
+    presence: Optional['ChunkPresence'] = None,
+    shape: Optional[QueryShape] = None,
+) -> Hits:
+    """
+    iter_world_hits(), but stopping once the `limit` blocks closest to center
+    have been found
+    """
+    chunk_y_ranges = get_chunk_y_ranges(x_range, y_range, z_range, shape)
+    chunks = [chunk for _ring, ring_chunks in iter_chunk_rings(center, x_range, z_range, chunk_y_ranges) for chunk in ring_chunks]
+    bounds = get_chunk_dist_bounds(chunks, center, x_range, y_range, z_range)
+    nearest = NearestBlocks(center, limit)
+    with open_world_db(world_path) if db is None else contextlib.nullcontext(db) as db:
+        for chunk_number, chunk_index in enumerate(np.argsort(bounds, kind='stable').tolist()):
+            if nearest.full and nearest.furthest < bounds[chunk_index]:
+                logger.info(f'Found the nearest {limit} after {chunk_number} of {len(chunks)} chunks')
+                break
+            chunk_x, chunk_z = chunks[chunk_index]
+            logger.debug(f'  Check chunk {chunk_x:4}, {chunk_z:4} (no closer than {bounds[chunk_index]})')
+            stored = get_stored_subchunks(db, dimension, chunk_x, chunk_z, presence, cache, stats)
+            if stored is None:
+                stats.counts['chunks_ungenerated'] += 1
+                continue
+            chunk_y_range = chunk_y_ranges[(chunk_x, chunk_z)]
+            nearest.add(scan_chunk(
+                chunk_x=chunk_x,
+                chunk_z=chunk_z,
+                subchunks=load_subchunks(db, dimension, chunk_x, chunk_z, chunk_y_range, cache, stats, stored),
+                x_range=x_range,
+                y_range=chunk_y_range,
+                z_range=z_range,
+                classifier=classifier,
+                stats=stats,
+                shape=shape,
+            ))
+
+    return nearest.get_hits()
+
+
+def iter_block_entity_hits(
+    world_path: Path,
+    dimension: int,
+    center: Coords,
+    x_range: Tuple[int, int],
+    y_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    classifier: BlockClassifier,
+    stats: ScanStats,
+    db=None,
+    key_order: bool = False,
+    details: Optional[dict[Coords, str]] = None,
+    presence: Optional['ChunkPresence'] = None,
+    shape: Optional[QueryShape] = None,
+) -> Iterator[Hits]:
+    """
+    iter_world_hits(), but only for blocks with a block entity (see
+    BLOCK_ENTITY_BLOCKS), found from the block entity records alone
+    """
+    x_min, x_max = x_range
+    y_min, y_max = y_range
+    z_min, z_max = z_range
+    wanted = {
+        entity_id: BLOCKS[intern_block(block)].canonical
+        for entity_id, block in BLOCK_ENTITY_BLOCKS.items()
+        if classifier.classify(intern_block(block)) == BLOCK_INTERESTING
+    }
+    logger.info(f'Looking for block entities of {", ".join(sorted(set(wanted.values()))) or "nothing"}')
+
+    rings = iter_chunk_rings(center, x_range, z_range, get_chunk_y_ranges(x_range, y_range, z_range, shape))
+    if key_order:
+        rings = [('all', sort_chunks_by_key([chunk for _ring, chunks in rings for chunk in chunks], dimension))]
+
+    with open_world_db(world_path) if db is None else contextlib.nullcontext(db) as db:
+        for ring, chunks in rings:
+            logger.info(f'Chunk dist {ring}')
+            for chunk_x, chunk_z in chunks:
+                if presence is not None and presence.get_stored(chunk_x, chunk_z) is None:
+                    stats.counts['chunks_ungenerated'] += 1
+                    continue
+                with stats.time('read'):
+                    entities = read_block_entities(db, dimension, chunk_x, chunk_z)
+                stats.counts['chunks'] += 1
+                found = defaultdict(list)
+                for entity in entities:
+                    name = wanted.get(entity.get('id'))
+                    x, y, z = entity.get('x'), entity.get('y'), entity.get('z')
+                    if name is None or not (x_min <= x <= x_max and y_min <= y <= y_max and z_min <= z <= z_max):
+                        continue
+                    if shape is not None and not shape.contains(np.array([[x, y, z]]))[0]:
+                        continue
+                    found[name].append((x, y, z))
+                    if details is not None:
+                        details[(x, y, z)] = describe_block_entity(entity)
+                yield {name: [np.array(coords, dtype=np.int32)] for name, coords in found.items()}
+
+
+# ---------------------------------------------------------------------------
+# Persistent block index
+#
+# Building this walks every subchunk in a dimension once and records the
+# position of every block that isn't in IGNORE. Subsequent queries (with any
+# combination of optional block groups) can then be answered straight from
+# the index without going anywhere near leveldb
+
+INDEX_VERSION = 2
+
+
+def get_last_updated(world_path: Path) -> float:
+    return (world_path / 'last_updated').stat().st_mtime
+
+
+def parse_chunk_key(key: bytes) -> Optional[Tuple[int, int, int, int, Optional[int]]]:
+    """
+    Parse a leveldb chunk record key into (dimension, chunk_x, chunk_z, tag, subchunk_y)
+
+    Returns None if this isn't a chunk record
+    """
+    if len(key) in (9, 10):
+        chunk_x, chunk_z = struct.unpack_from('<ii', key)
+        dimension = 0
+        rest = key[8:]
+    elif len(key) in (13, 14):
+        chunk_x, chunk_z, dimension = struct.unpack_from('<iii', key)
+        rest = key[12:]
+    else:
+        return None
+
+    # there are a handful of other (non-chunk) keys that happen to be the
+    # same length, eg 'BiomeData'
+    if dimension not in (0, 1, 2):
+        return None
+    tag = rest[0]
+    if len(rest) == 2:
+        if tag != TAG_SUBCHUNK_PREFIX:
+            return None
+        subchunk_y, = struct.unpack('<b', rest[1:])
+    else:
+        subchunk_y = None
+    return dimension, chunk_x, chunk_z, tag, subchunk_y
+
+
+def iter_subchunk_records(db, dimension: int):
+    """
+    Yield (chunk_x, chunk_z, subchunk_y, data) for every stored subchunk in a dimension
+    """
+    for key, data in bedrock.leveldb.iterate(db):
+        parsed = parse_chunk_key(key)
+        if parsed is None:
+            continue
+        key_dimension, chunk_x, chunk_z, tag, subchunk_y = parsed
+        if key_dimension == dimension and tag == TAG_SUBCHUNK_PREFIX:
+            yield chunk_x, chunk_z, subchunk_y, data
+
+
+INDEX_IGNORE = frozenset(IGNORE)
+
+IndexedBlocks = dict[BlockType, dict[Tuple[int, int], list['np.ndarray']]]
+
+
+def index_subchunk(found: IndexedBlocks, chunk_x: int, chunk_z: int, subchunk_y: int, data: bytes):
+    """
+    Add the position of every non-ignored block in a subchunk record to `found`
+    """
+    subchunk = SubChunk(data)
+    # nothing is interesting to the index; it records everything not ignored
+    palette_classes = compile_blocks(frozenset(), INDEX_IGNORE).classify(subchunk.palette_ids)
+    if not palette_classes.any():
+        return
+    base = np.array([chunk_x, subchunk_y, chunk_z]) * CHUNK_SIZE
+    for palette_index in np.flatnonzero(palette_classes):
+        x, z, y = np.nonzero(subchunk.blocks == palette_index)
+        if len(x):
+            name, _dv = subchunk.palette[palette_index]
+            found[name][(chunk_x, chunk_z)].append(np.column_stack((x, y, z)) + base)
+
+
+class BlockIndex:
+    """
+    On-disk index of every non-ignored block in one dimension of a world:
+    manifest.json, coords.npy (x,y,z by name then chunk), chunks.npy (the runs
+    of coords per name and chunk) and per chunk digests for incremental refreshes
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with (path / 'manifest.json').open() as f:
+            self.manifest = json.load(f)
+        self.names: list[BlockType] = self.manifest['names']
+        self.name_ids = np.array([intern_block(name) for name in self.names], dtype=np.intp)
+        self.coords = np.load(path / 'coords.npy', mmap_mode='r')
+        self.chunks = np.load(path / 'chunks.npy', mmap_mode='r')
+
+    @staticmethod
+    def get_path(index_dir: Path, world_path: Path, dimension: int) -> Path:
+        return index_dir / Path(world_path).resolve().name / f'dim{dimension}'
+
+    def is_compatible(self) -> bool:
+        """
+        Whether this index can be incrementally refreshed rather than rebuilt from scratch
+        """
+        return (
+            self.manifest.get('version') == INDEX_VERSION
+            and self.manifest.get('ignore') == sorted(IGNORE)
+        )
+
+    def is_current(self, world_path: Path) -> bool:
+        return self.is_compatible() and self.manifest.get('last_updated') == get_last_updated(world_path)
+
+    def get_digests(self) -> dict[Tuple[int, int], bytes]:
+        digest_chunks = np.load(self.path / 'digest_chunks.npy')
+        digests = np.load(self.path / 'digests.npy')
+        return {
+            (chunk_x, chunk_z): digest.tobytes()
+            for (chunk_x, chunk_z), digest in zip(digest_chunks.tolist(), digests)
+        }
+
+    @classmethod
+    def open(cls, index_dir: Path, world_path: Path, dimension: int) -> Optional['BlockIndex']:
+        """
+        Open the existing index for a world (whether or not it's up to date), or None if there isn't one
+        """
+        path = cls.get_path(index_dir, world_path, dimension)
+        if not (path / 'manifest.json').exists():
+            return None
+        return cls(path)
+
+    @classmethod
+    def load(cls, index_dir: Path, world_path: Path, dimension: int) -> Optional['BlockIndex']:
+        """
+        Load the index for a world, or None if it's never been indexed or the index is stale
+        (see refresh_index())
+        """
+        index = cls.open(index_dir, world_path, dimension)
+        if index is None or index.is_current(world_path):
+            return index
+        logger.warning(f'World has changed since {index.path} was built; not using it')
+        return None
+
+    @classmethod
+    def build(
+        cls,
+        index_dir: Path,
+        world_path: Path,
+        dimension: int,
+        db,
+        previous: Optional['BlockIndex'] = None,
+    ) -> 'BlockIndex':
+        """
+        Build the index for a world from its open db
+
+        If `previous` is given then only chunks whose subchunk records have
+        changed since it was built are decoded; everything else is carried over
+        """
+        path = cls.get_path(index_dir, world_path, dimension)
+        last_updated = get_last_updated(world_path)
+
+        found: IndexedBlocks = defaultdict(lambda: defaultdict(list))
+        digests = {}
+        subchunk_ys = defaultdict(list)
+        for chunk_x, chunk_z, subchunk_y, data in iter_subchunk_records(db, dimension):
+            chunk = (chunk_x, chunk_z)
+            if chunk not in digests:
+                digests[chunk] = hashlib.blake2b(digest_size=16)
+            digests[chunk].update(struct.pack('<bi', subchunk_y, len(data)))
+            digests[chunk].update(data)
+            if previous is None:
+                index_subchunk(found, chunk_x, chunk_z, subchunk_y, data)
+            else:
+                subchunk_ys[chunk].append(subchunk_y)
+        digests = {chunk: digest.digest() for chunk, digest in digests.items()}
+
+        if previous is not None:
+            previous_digests = previous.get_digests()
+            changed = {chunk for chunk, digest in digests.items() if previous_digests.get(chunk) != digest}
+            logger.info(f'{len(changed)} of {len(digests)} chunks have changed')
+
+            # carry over everything from unchanged chunks; chunks that no
+            # longer exist aren't in `digests` so are dropped
+            for name_index, chunk_x, chunk_z, start, end in previous.chunks.tolist():
+                chunk = (chunk_x, chunk_z)
+                if chunk in digests and chunk not in changed:
+                    found[previous.names[name_index]][chunk].append(np.array(previous.coords[start:end]))
+
+            for chunk_x, chunk_z in changed:
+                for subchunk_y in subchunk_ys[(chunk_x, chunk_z)]:
+                    data = bedrock.leveldb.get(db, chunk_key(chunk_x, chunk_z, dimension, TAG_SUBCHUNK_PREFIX, subchunk_y))
+                    index_subchunk(found, chunk_x, chunk_z, subchunk_y, data)
+
+        names = sorted(found)
+        coords = []
+        chunks = []
+        row = 0
+        for name_index, name in enumerate(names):
+            for (chunk_x, chunk_z), chunk_coords in sorted(found[name].items()):
+                chunk_coords = np.concatenate(chunk_coords)
+                coords.append(chunk_coords)
+                chunks.append((name_index, chunk_x, chunk_z, row, row + len(chunk_coords)))
+                row += len(chunk_coords)
+
+        # write to a temporary directory and swap it in so that a failed
+        # build never leaves a half written index behind
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir()
+        np.save(tmp_path / 'coords.npy', np.concatenate(coords).astype(np.int32) if coords else np.empty((0, 3), dtype=np.int32))
+        np.save(tmp_path / 'chunks.npy', np.array(chunks, dtype=np.int32).reshape(-1, 5))
+        np.save(tmp_path / 'digest_chunks.npy', np.array(list(digests.keys()), dtype=np.int32).reshape(-1, 2))
+        np.save(tmp_path / 'digests.npy', np.frombuffer(b''.join(digests.values()), dtype=np.uint8).reshape(-1, 16))
+        with (tmp_path / 'manifest.json').open('w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'dimension': dimension,
+                'last_updated': last_updated,
+                'ignore': sorted(IGNORE),
+                'names': names,
+            }, f)
+        shutil.rmtree(path, ignore_errors=True)
+        tmp_path.rename(path)
+
+        logger.info(f'Indexed {row} blocks from {len(digests)} chunks into {path}')
+        return cls(path)
+
+    def iter_query(
+        self,
+        x_range: Tuple[int, int],
+        y_range: Tuple[int, int],
+        z_range: Tuple[int, int],
+        classifier: BlockClassifier,
+        center: Optional[Coords] = None,
+        shape: Optional[QueryShape] = None,
+    ) -> Iterator[Hits]:
+        """
+        The index equivalent of scan_chunk() across the whole of the given (inclusive) ranges
+        (and shape, if any), yielding the hits for one block name in one chunk at a time
+
+        If center is given the chunks are visited in ring order around it
+        """
+        x_min, x_max = x_range
+        y_min, y_max = y_range
+        z_min, z_max = z_range
+        chunks = self.chunks
+        in_range = (
+            (chunks[:, 1] >= x_min // CHUNK_SIZE) & (chunks[:, 1] <= x_max // CHUNK_SIZE)
+            & (chunks[:, 2] >= z_min // CHUNK_SIZE) & (chunks[:, 2] <= z_max // CHUNK_SIZE)
+        )
+        chunks = chunks[in_range]
+        if center is not None:
+            center_x, _center_y, center_z = center
+            ring = np.maximum(
+                np.abs(chunks[:, 1] - center_x // CHUNK_SIZE),
+                np.abs(chunks[:, 2] - center_z // CHUNK_SIZE),
+            )
+            chunks = chunks[np.argsort(ring, kind='stable')]
+
+        name_classes = classifier.classify(self.name_ids).tolist()
+        for name_index, _chunk_x, _chunk_z, start, end in chunks.tolist():
+            if name_classes[name_index] == BLOCK_IGNORE:
+                continue
+            coords = self.coords[start:end]
+            x, y, z = coords[:, 0], coords[:, 1], coords[:, 2]
+            coords = coords[
+                (x >= x_min) & (x <= x_max)
+                & (y >= y_min) & (y <= y_max)
+                & (z >= z_min) & (z <= z_max)
+            ]
+            if shape is not None:
+                coords = coords[shape.contains(coords)]
+            if not len(coords):
+                continue
+            block = BLOCKS[self.name_ids[name_index]]
+            if name_classes[name_index] == BLOCK_INTERESTING:
+                yield {block.canonical: [np.array(coords)]}
+            else:
+                for _ in range(len(coords)):
+                    logger.error(f'Unrecognised block {block.name}/None')
+
+    def query(
+        self,
+        x_range: Tuple[int, int],
+        y_range: Tuple[int, int],
+        z_range: Tuple[int, int],
+        classifier: BlockClassifier,
+        shape: Optional[QueryShape] = None,
+    ) -> Hits:
+        hits: Hits = defaultdict(list)
+        for chunk_hits in self.iter_query(x_range, y_range, z_range, classifier, shape=shape):
+            merge_hits(hits, chunk_hits)
+        return hits
+
+
+class ChunkPresence:
+    """
+    Which chunks have been generated in one dimension of a world, and a bitmask
+    of their stored subchunks; every dimension is saved in presence.npz
+    """
+
+    def __init__(self, chunks: np.ndarray, subchunks: np.ndarray):
+        self.chunks = chunks
+        self.subchunks = subchunks
+
+    @staticmethod
+    def get_path(index_dir: Path, world_path: Path) -> Path:
+        return index_dir / Path(world_path).resolve().name / 'presence.npz'
+
+    @staticmethod
+    def get_keys(chunk_x, chunk_z):
+        return (np.asarray(chunk_x, dtype=np.int64) << 32) | (np.asarray(chunk_z, dtype=np.int64) & 0xffffffff)
+
+    def get_stored(self, chunk_x: int, chunk_z: int) -> Optional[int]:
+        """
+        Bitmask of the stored subchunks of a chunk (see load_subchunks()), or None
+        if it hasn't been generated
+        """
+        key = self.get_keys(chunk_x, chunk_z)
+        i = np.searchsorted(self.chunks, key)
+        if i == len(self.chunks) or self.chunks[i] != key:
+            return None
+        return int(self.subchunks[i])
+
+    @classmethod
+    def build(cls, index_dir: Path, world_path: Path, db) -> dict[int, 'ChunkPresence']:
+        """
+        Build (and save) the presence of every dimension of a world from its open db
+        """
+        last_updated = get_last_updated(world_path)
+        generated = set()
+        stored = defaultdict(int)
+        for key, _data in bedrock.leveldb.iterate(db):
+            parsed = parse_chunk_key(key)
+            if parsed is None:
+                continue
+            dimension, chunk_x, chunk_z, tag, subchunk_y = parsed
+            if tag in (TAG_VERSION, TAG_LEGACY_VERSION):
+                generated.add((dimension, chunk_x, chunk_z))
+            elif tag == TAG_SUBCHUNK_PREFIX and 0 <= subchunk_y - PRESENCE_MIN_SUBCHUNK_Y < 64:
+                stored[(dimension, chunk_x, chunk_z)] |= 1 << (subchunk_y - PRESENCE_MIN_SUBCHUNK_Y)
+
+        arrays = {'last_updated': np.array(last_updated)}
+        presences = {}
+        for dimension in (0, 1, 2):
+            chunks = np.array(sorted((chunk_x, chunk_z) for d, chunk_x, chunk_z in generated if d == dimension), dtype=np.int64).reshape(-1, 2)
+            keys = cls.get_keys(chunks[:, 0], chunks[:, 1])
+            order = np.argsort(keys)
+            subchunks = np.array(
+                [stored.get((dimension, chunk_x, chunk_z), 0) for chunk_x, chunk_z in chunks.tolist()],
+                dtype=np.uint64,
+            )
+            arrays[f'chunks_{dimension}'] = keys[order]
+            arrays[f'subchunks_{dimension}'] = subchunks[order]
+            presences[dimension] = cls(keys[order], subchunks[order])
+            logger.info(
+                f'Dimension {dimension}: {len(chunks)} generated chunks,'
+                f' {sum(bin(mask).count("1") for mask in subchunks.tolist())} stored subchunks'
+            )
+
+        path = cls.get_path(index_dir, world_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name('presence.tmp.npz')
+        np.savez(tmp_path, **arrays)
+        tmp_path.replace(path)
+        return presences
+
+    @classmethod
+    def is_stale(cls, index_dir: Path, world_path: Path) -> bool:
+        """
+        Whether the presence has been built but the world has changed since
+        """
+        path = cls.get_path(index_dir, world_path)
+        if not path.exists():
+            return False
+        with np.load(path) as arrays:
+            return arrays['last_updated'] != get_last_updated(world_path)
+
+    @classmethod
+    def load(cls, index_dir: Path, world_path: Path, dimension: int) -> Optional['ChunkPresence']:
+        """
+        Load the presence of a dimension, or None if it's never been built or is stale
+        (see refresh_index())
+        """
+        path = cls.get_path(index_dir, world_path)
+        if not path.exists():
+            return None
+        with np.load(path) as arrays:
+            if arrays['last_updated'] == get_last_updated(world_path):
+                return cls(arrays[f'chunks_{dimension}'], arrays[f'subchunks_{dimension}'])
+        logger.warning(f'World has changed since {path} was built; not using it')
+        return None
+
+
+def is_index_stale(index_dir: Path, world_path: Path, dimension: int) -> bool:
+    """
+    Whether refresh_index() has anything to do, without opening the world
+    """
+    index = BlockIndex.open(index_dir, world_path, dimension)
+    return ChunkPresence.is_stale(index_dir, world_path) or (index is not None and not index.is_current(world_path))
+
+
+def refresh_index(index_dir: Path, world_path: Path, dimension: int, db):
+    """
+    Rebuild the chunk presence and (incrementally) the block index of a world if
+    they're stale, using the caller's open db (leveldb can only be opened once)
+    """
+    if ChunkPresence.is_stale(index_dir, world_path):
+        logger.warning(f'World has changed since {ChunkPresence.get_path(index_dir, world_path)} was built; refreshing')
+        ChunkPresence.build(index_dir, world_path, db)
+    index = BlockIndex.open(index_dir, world_path, dimension)
+    if index is not None and not index.is_current(world_path):
+        logger.warning(f'World has changed since {index.path} was built; refreshing')
+        BlockIndex.build(index_dir, world_path, dimension, db, previous=index if index.is_compatible() else None)
+
+
+def get_log_level(log_level: int) -> int:
+    levels = {
+        0: logging.WARNING,
+        1: logging.INFO,
+        2: logging.DEBUG
+    }
+    return levels[min(len(levels) - 1, log_level)]
+
+
+def init_logger(log_level: int) -> logging.Logger:
+    level = get_log_level(log_level)
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    logger = logging.getLogger('mc-scan')
+    return logger
+
+
+def get_block_sets(
+    optional_blocks_chosen: dict[BlockGroupType, bool],
+    block_names: Optional[list[BlockType]] = None,
+) -> Tuple[set[BlockType], set[BlockType]]:
+    """
+    The (interesting, ignore) block sets for a query
+    """
+    interesting_blocks = INTERESTING.copy()
+    ignore_blocks = IGNORE.copy()
+    for key, value in optional_blocks_chosen.items():
+        if value:
+            interesting_blocks.update(OPTIONAL_BLOCKS[key])
+        else:
+            ignore_blocks.update(OPTIONAL_BLOCKS[key])
+
+    if block_names:
+        # only look for the given blocks (and their deepslate variants); every
+        # other block we know about is ignored
+        interesting_blocks = set(block_names)
+        interesting_blocks.update(name.replace('minecraft:', 'minecraft:deepslate_', 1) for name in block_names)
+        ignore_blocks.update(INTERESTING)
+        for blocks in OPTIONAL_BLOCKS.values():
+            ignore_blocks.update(blocks)
+        ignore_blocks -= interesting_blocks
+
+    return interesting_blocks, ignore_blocks
+
+
+def get_classifier(
+    optional_blocks_chosen: dict[BlockGroupType, bool],
+    block_names: Optional[list[BlockType]] = None,
+) -> BlockClassifier:
+    """
+    The compiled get_block_sets() for a query
+    """
+    return compile_query_blocks(
+        frozenset(key for key, value in optional_blocks_chosen.items() if value),
+        frozenset(block_names or ()),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def compile_query_blocks(groups_chosen: frozenset[BlockGroupType], block_names: frozenset[BlockType]) -> BlockClassifier:
+    # only worked out once per combination of optional groups (or --block names)
+    interesting_blocks, ignore_blocks = get_block_sets(
+        {key: key in groups_chosen for key in OPTIONAL_BLOCKS},
+        sorted(block_names),
+    )
+    return compile_blocks(frozenset(interesting_blocks), frozenset(ignore_blocks))
+
+
+def clip_to_dist(
+    center: Coords,
+    x_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    max_dist: int,
+) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    Narrow the x and z ranges to within max_dist of center; anything further than
+    that in x or z is outside the last ring
+    """
+    center_x, _center_y, center_z = center
+    x_min, x_max = x_range
+    z_min, z_max = z_range
+    return (
+        (max(x_min, center_x - max_dist), min(x_max, center_x + max_dist)),
+        (max(z_min, center_z - max_dist), min(z_max, center_z + max_dist)),
+    )
+
+
+def iter_scan(
+    dimension: int,
+    center: Coords,
+    x_range: int,
+    y_range: int,
+    z_range: int,
+    max_dist: int,
+    world_path: Path,
+    optional_blocks_chosen: dict[BlockGroupType, bool],
+    jobs: int = 1,
+    index: Optional[BlockIndex] = None,
+    db=None,
+    cache: Optional[ChunkCache] = None,
+    nearest: Optional[int] = None,
+    block_names: Optional[list[BlockType]] = None,
+    stats: Optional[ScanStats] = None,
+    key_order: bool = False,
+    entities: bool = False,
+    details: Optional[dict[Coords, str]] = None,
+    presence: Optional['ChunkPresence'] = None,
+    prefetch: int = 0,
+    shape: Optional[QueryShape] = None,
+) -> Iterator[Hits]:
+    """
+    Find the interesting blocks around center, yielding hits a chunk at a time
+    as they're found (see iter_world_hits())
+    """
+    classifier = get_classifier(optional_blocks_chosen, block_names)
+    x_range, z_range = clip_to_dist(center, x_range, z_range, max_dist)
+
+    stats = stats or ScanStats()
+    if entities:
+        found = iter_block_entity_hits(
+            world_path=world_path,
+            dimension=dimension,
+            center=center,
+            x_range=x_range,
+            y_range=y_range,
+            z_range=z_range,
+            classifier=classifier,
+            stats=stats,
+            db=db,
+            key_order=key_order,
+            details=details,
+            presence=presence,
+            shape=shape,
+        )
+        if nearest is not None:
+            nearest_blocks = NearestBlocks(center, nearest)
+            for hits in found:
+                nearest_blocks.add(hits)
+            found = [nearest_blocks.get_hits()]
+    elif index is not None:
+        logger.info(f'Using index {index.path}')
+        if nearest is not None:
+            with stats.time('index'):
+                nearest_blocks = NearestBlocks(center, nearest)
+                nearest_blocks.add(index.query(x_range, y_range, z_range, classifier, shape))
+            found = [nearest_blocks.get_hits()]
+        else:
+            found = iter_timed(index.iter_query(x_range, y_range, z_range, classifier, center, shape), stats, 'index')
+    elif nearest is not None:
+        if jobs > 1 or prefetch:
+            logger.info('Ignoring --jobs and --prefetch; --nearest reads chunks one at a time so it can stop early')
+        found = [scan_world_nearest(
+            world_path=world_path,
+            dimension=dimension,
+            center=center,
+            x_range=x_range,
+            y_range=y_range,
+            z_range=z_range,
+            classifier=classifier,
+            limit=nearest,
+            stats=stats,
+            db=db,
+            cache=cache,
+            presence=presence,
+            shape=shape,
+        )]
+    else:
+        if prefetch and jobs > 1:
+            logger.info('Ignoring --prefetch; it only applies to single process scans')
+        found = iter_world_hits(
+            world_path=world_path,
+            dimension=dimension,
+            center=center,
+            x_range=x_range,
+            y_range=y_range,
+            z_range=z_range,
+            classifier=classifier,
+            jobs=jobs,
+            stats=stats,
+            db=db,
+            cache=cache,
+            key_order=key_order,
+            presence=presence,
+            prefetch=prefetch,
+            shape=shape,
+        )
+
+    for hits in found:
+        stats.counts['hits'] += sum(len(coords) for coords_list in hits.values() for coords in coords_list)
+        yield hits
+
+    counts = stats.counts
+    if counts['chunks_ungenerated']:
+        logger.warning(f'Skipped {counts["chunks_ungenerated"]} chunks that have not been generated')
+    if counts['subchunks']:
+        logger.info(
+            f'Skipped {counts["subchunks_skipped"]} of {counts["subchunks"]} subchunks'
+            f' ({counts["subchunks_skipped"] / counts["subchunks"]:.0%}) on palette alone'
+        )
+    if cache is not None:
+        logger.info(f'Chunk cache: {cache.describe()}')
+
+
+class HitCluster(NamedTuple):
+    """
+    A connected group of found blocks (see ScanResults.clustered())
+    """
+    dist: float
+    closest: Coords
+    centroid: Tuple[float, float, float]
+    min: Coords
+    max: Coords
+    count: int
+    blocks: dict[BlockType, int]
+
+
+def get_components(count: int, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+    Union-find over `count` items joined by the edges first[i] - second[i],
+    returning the lowest numbered item in the component of each
+    """
+    parent = np.arange(count)
+    while True:
+        first_root = parent[first]
+        second_root = parent[second]
+        joins = first_root != second_root
+        if not joins.any():
+            return parent
+        # components only ever merge, so an edge within one never matters again
+        first, second = first[joins], second[joins]
+        first_root, second_root = first_root[joins], second_root[joins]
+        np.minimum.at(parent, np.maximum(first_root, second_root), np.minimum(first_root, second_root))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+class ScanResults:
+    """
+    Everything found by scan(): per (canonical) block name, an (N, 3) int32
+    x,y,z array and a float32 array of distances from center
+    """
+
+    def __init__(self, center: Coords):
+        self.center = center
+        self._coords: dict[BlockType, np.ndarray] = {}
+        self._dists: dict[BlockType, np.ndarray] = {}
+        # arrays add()ed since coords/dists were last read; concatenating on every
+        # add() would copy everything found so far each time
+        self.pending: dict[BlockType, list[np.ndarray]] = defaultdict(list)
+
+    @property
+    def coords(self) -> dict[BlockType, np.ndarray]:
+        self.concatenate_pending()
+        return self._coords
+
+    @property
+    def dists(self) -> dict[BlockType, np.ndarray]:
+        self.concatenate_pending()
+        return self._dists
+
+    def __len__(self) -> int:
+        return sum(len(coords) for coords in self._coords.values()) + sum(
+            len(coords) for coords_list in self.pending.values() for coords in coords_list
+        )
+
+    def add(self, name: BlockType, coords: np.ndarray):
+        """
+        Append an (N, 3) x,y,z array of blocks
+        """
+        self.pending[name].append(coords)
+
+    def concatenate_pending(self):
+        """
+        Fold everything add()ed since the last call into coords and dists, one concatenate per block name
+        """
+        for name, coords_list in self.pending.items():
+            coords = np.concatenate(coords_list).astype(np.int32, copy=False)
+            dists = get_dists(coords, self.center).astype(np.float32)
+            if name in self._coords:
+                coords = np.concatenate((self._coords[name], coords))
+                dists = np.concatenate((self._dists[name], dists))
+            self._coords[name] = coords
+            self._dists[name] = dists
+        self.pending.clear()
+
+    def get_digest(self) -> str:
+        """
+        Hash of every (name, x, y, z) found, independent of the order they were found in
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for name in sorted(self.coords):
+            coords = self.coords[name]
+            coords = coords[np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0]))]
+            digest.update(struct.pack('<Hq', len(name), len(coords)) + name.encode('utf-8'))
+            digest.update(coords.astype('<i4').tobytes())
+        return digest.hexdigest()
+
+    def sorted_by_dist(self, name: BlockType) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (dists, coords) for one block name, closest first (then by x, y, z)
+        """
+        coords = self.coords[name]
+        order = np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0], self.dists[name]))
+        return self.dists[name][order], coords[order]
+
+    def sorted_by_dist_all(self) -> Tuple[np.ndarray, list[BlockType], np.ndarray]:
+        """
+        (dists, names, coords) for every block, closest first (then by name, x, y, z)
+        """
+        names = sorted(self.coords)
+        if not names:
+            return np.empty(0, dtype=np.float32), [], np.empty((0, 3), dtype=np.int32)
+        coords = np.concatenate([self.coords[name] for name in names])
+        dists = np.concatenate([self.dists[name] for name in names])
+        name_index = np.repeat(np.arange(len(names)), [len(self.coords[name]) for name in names])
+        order = np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0], name_index, dists))
+        return dists[order], [names[i] for i in name_index[order].tolist()], coords[order]
+
+    def grouped(self, name: BlockType, round_to: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Bucket the blocks for one name into round_to sized cubes, returning the
+        (K, 3) corner of each bucket and the number of blocks in it, in the order
+        each bucket was first found in
+        """
+        coords = self.coords[name]
+        buckets, first_index, counts = np.unique(
+            coords - coords % round_to, axis=0, return_index=True, return_counts=True
+        )
+        order = np.argsort(first_index)
+        return buckets[order], counts[order]
+
+    def clustered(self, gap: int = 1) -> list[HitCluster]:
+        """
+        Group the blocks (of every name) into clusters, the connected groups where
+        each block is within `gap` of another in each of x, y and z; closest first
+        """
+        names = sorted(self.coords)
+        if not len(self):
+            return []
+        coords = np.concatenate([self.coords[name] for name in names]).astype(np.int64)
+        dists = np.concatenate([self.dists[name] for name in names])
+        name_index = np.repeat(np.arange(len(names)), [len(self.coords[name]) for name in names])
+
+        # with a gap's margin either side a neighbour's key can't wrap around into the next row
+        low = coords.min(axis=0) - gap
+        size = coords.max(axis=0) - low + gap + 1
+        offset = coords - low
+        keys = (offset[:, 0] * size[1] + offset[:, 1]) * size[2] + offset[:, 2]
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+
+        # each pair of neighbours only needs finding from one end. Neighbours are
+        # looked for a row (of z) at a time: any within gap of a block in a given
+        # row are next to each other in key order, so one search finds the first
+        # of them and the others (if any) are the ones straight after it
+        first, second = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for dx in range(0, gap + 1):
+            for dy in range(-gap, gap + 1):
+                if (dx, dy) < (0, 0):
+                    continue
+                dz_min = 1 if (dx, dy) == (0, 0) else -gap
+                row_keys = sorted_keys + (dx * size[1] + dy) * size[2]
+                start = np.searchsorted(sorted_keys, row_keys + dz_min)
+                for step in range(gap - dz_min + 1):
+                    index = np.minimum(start + step, len(keys) - 1)
+                    found = (start + step < len(keys)) & (sorted_keys[index] <= row_keys + gap)
+                    first.append(order[found])
+                    second.append(order[index[found]])
+        components = get_components(len(coords), np.concatenate(first), np.concatenate(second))
+
+        _roots, cluster_index = np.unique(components, return_inverse=True)
+        cluster_index = cluster_index.reshape(-1)
+        cluster_count = cluster_index.max() + 1
+        counts = np.bincount(cluster_index, minlength=cluster_count)
+        centroids = np.column_stack([
+            np.bincount(cluster_index, weights=coords[:, axis], minlength=cluster_count) for axis in range(3)
+        ]) / counts[:, None]
+        mins = np.full((cluster_count, 3), np.iinfo(np.int64).max)
+        maxs = np.full((cluster_count, 3), np.iinfo(np.int64).min)
+        np.minimum.at(mins, cluster_index, coords)
+        np.maximum.at(maxs, cluster_index, coords)
+        by_dist = np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0], dists, cluster_index))
+        closest = by_dist[np.searchsorted(cluster_index[by_dist], np.arange(cluster_count))]
+        name_counts = np.bincount(
+            cluster_index * len(names) + name_index, minlength=cluster_count * len(names)
+        ).reshape(cluster_count, len(names))
+
+        # there can be a lot of clusters, so only the final tuples are built one by one
+        closest_coords = coords[closest]
+        order = np.lexsort((closest_coords[:, 2], closest_coords[:, 1], closest_coords[:, 0], dists[closest]))
+        return [
+            HitCluster(
+                dist=dist,
+                closest=tuple(closest_block),
+                centroid=tuple(centroid),
+                min=tuple(cluster_min),
+                max=tuple(cluster_max),
+                count=count,
+                blocks={
+                    names[i]: name_count
+                    for i, name_count in sorted(enumerate(row), key=lambda item: -item[1])
+                    if name_count
+                },
+            )
+            for dist, closest_block, centroid, cluster_min, cluster_max, count, row in zip(
+                dists[closest][order].tolist(),
+                closest_coords[order].tolist(),
+                centroids[order].tolist(),
+                mins[order].tolist(),
+                maxs[order].tolist(),
+                counts[order].tolist(),
+                name_counts[order].tolist(),
+            )
+        ]
+
+
+def scan(center: Coords, stats: Optional[ScanStats] = None, **kwargs) -> ScanResults:
+    """
+    iter_scan(), with all the hits collected up into a ScanResults
+
+    Takes the same arguments as iter_scan()
+    """
+    stats = stats or ScanStats()
+    hits: Hits = defaultdict(list)
+    # everything is put back into ring order at the end so the chunks can be
+    # read in whatever order is quickest
+    for chunk_hits in iter_scan(center=center, stats=stats, key_order=True, **kwargs):
+        with stats.time('collect'):
+            merge_hits(hits, chunk_hits)
+
+    with stats.time('collect'):
+        return collect_results(center, hits)
+
+
+def collect_results(center: Coords, hits: Hits) -> ScanResults:
+    # chunks are scanned as a whole (and possibly out of order when running
+    # in parallel) so put the hits back into ring order; this keeps the output
+    # (in particular the json key order) stable
+    ordered = []
+    for name, coords in hits.items():
+        coords = np.concatenate(coords)
+        keys = ring_order_keys(coords, center)
+        order = np.lexsort(keys[::-1])
+        first_key = tuple(key[order[0]] for key in keys)
+        ordered.append((first_key, name, coords[order]))
+    ordered.sort(key=lambda item: item[0])
+
+    results = ScanResults(center)
+    for _first_key, name, coords in ordered:
+        results.add(name, coords)
+    return results
+
+
+def scan_batch(
+    queries: list[dict],
+    world_path: Path,
+    stats: ScanStats,
+    index_dir: Optional[Path] = None,
+    db=None,
+    cache: Optional[ChunkCache] = None,
+) -> list[ScanResults]:
+    """
+    scan() each of several queries (dicts of iter_scan() arguments), reading
+    each chunk any of them needs just once; returns the results in order
+    """
+    results: list[Optional[ScanResults]] = [None] * len(queries)
+    by_dimension: dict[int, list[int]] = defaultdict(list)
+    for query_number, query in enumerate(queries):
+        by_dimension[query['dimension']].append(query_number)
+
+    with open_world_db(world_path) if db is None else contextlib.nullcontext(db) as db:
+        # refresh and load everything up front, through this db
+        indexes: dict[int, Optional[BlockIndex]] = {}
+        presences: dict[int, Optional[ChunkPresence]] = {}
+        if index_dir is not None:
+            with stats.time('index'):
+                for dimension in by_dimension:
+                    refresh_index(index_dir, world_path, dimension, db)
+                    indexes[dimension] = BlockIndex.load(index_dir, world_path, dimension)
+                    presences[dimension] = ChunkPresence.load(index_dir, world_path, dimension)
+
+        for dimension, query_numbers in by_dimension.items():
+            index = indexes.get(dimension)
+            if index is not None:
+                for query_number in query_numbers:
+                    results[query_number] = scan(world_path=world_path, index=index, db=db, stats=stats, **queries[query_number])
+                continue
+            presence = presences.get(dimension)
+
+            # these don't read any terrain so there's nothing to share
+            for query_number in query_numbers:
+                if queries[query_number]['entities']:
+                    results[query_number] = scan(
+                        world_path=world_path, db=db, stats=stats, presence=presence, **queries[query_number]
+                    )
+            query_numbers = [query_number for query_number in query_numbers if not queries[query_number]['entities']]
+
+            # per query: x, z ranges, the y range of each chunk and classifier;
+            # and the queries that need each chunk
+            scans = {}
+            chunk_queries: dict[Tuple[int, int], list[int]] = defaultdict(list)
+            for query_number in query_numbers:
+                query = queries[query_number]
+                x_range, z_range = clip_to_dist(query['center'], query['x_range'], query['z_range'], query['max_dist'])
+                chunk_y_ranges = get_chunk_y_ranges(x_range, query['y_range'], z_range, query['shape'])
+                classifier = get_classifier(query['optional_blocks_chosen'], query['block_names'])
+                scans[query_number] = (x_range, z_range, chunk_y_ranges, classifier)
+                for chunk in chunk_y_ranges:
+                    chunk_queries[chunk].append(query_number)
+            logger.info(
+                f'Reading {len(chunk_queries)} chunks for {len(query_numbers)} queries'
+                f' ({sum(map(len, chunk_queries.values()))} if run separately)'
+            )
+
+            hits: dict[int, Hits] = {query_number: defaultdict(list) for query_number in query_numbers}
+            nearest = {
+                query_number: NearestBlocks(queries[query_number]['center'], queries[query_number]['nearest'])
+                for query_number in query_numbers
+                if queries[query_number]['nearest'] is not None
+            }
+            ungenerated = 0
+            for chunk_x, chunk_z in sort_chunks_by_key(list(chunk_queries), dimension):
+                chunk_query_numbers = chunk_queries[(chunk_x, chunk_z)]
+                logger.debug(f'  Check chunk {chunk_x:4}, {chunk_z:4} for {len(chunk_query_numbers)} queries')
+                y_ranges = [scans[query_number][2][(chunk_x, chunk_z)] for query_number in chunk_query_numbers]
+                y_range = (min(y_min for y_min, _y_max in y_ranges), max(y_max for _y_min, y_max in y_ranges))
+                stored = get_stored_subchunks(db, dimension, chunk_x, chunk_z, presence, cache, stats)
+                if stored is None:
+                    ungenerated += 1
+                    continue
+                subchunks = load_subchunks(db, dimension, chunk_x, chunk_z, y_range, cache, stats, stored)
+                for query_number in chunk_query_numbers:
+                    x_range, z_range, chunk_y_ranges, classifier = scans[query_number]
+                    y_min, y_max = chunk_y_ranges[(chunk_x, chunk_z)]
+                    chunk_hits = scan_chunk(
+                        chunk_x=chunk_x,
+                        chunk_z=chunk_z,
+                        subchunks={
+                            subchunk_y: subchunk for subchunk_y, subchunk in subchunks.items()
+                            if y_min // CHUNK_SIZE <= subchunk_y <= y_max // CHUNK_SIZE
+                        },
+                        x_range=x_range,
+                        y_range=(y_min, y_max),
+                        z_range=z_range,
+                        classifier=classifier,
+                        stats=stats,
+                        shape=queries[query_number]['shape'],
+                    )
+                    if query_number in nearest:
+                        nearest[query_number].add(chunk_hits)
+                    else:
+                        merge_hits(hits[query_number], chunk_hits)
+            if ungenerated:
+                logger.warning(f'Skipped {ungenerated} chunks in dimension {dimension} that have not been generated')
+            stats.counts['chunks_ungenerated'] += ungenerated
+
+            with stats.time('collect'):
+                for query_number in query_numbers:
+                    query_hits = nearest[query_number].get_hits() if query_number in nearest else hits[query_number]
+                    stats.counts['hits'] += sum(len(coords) for coords_list in query_hits.values() for coords in coords_list)
+                    results[query_number] = collect_results(queries[query_number]['center'], query_hits)
+
+    return results
+
+
+def show_interesting_text(results: ScanResults, details: Optional[dict[Coords, str]] = None):
+    details = details or {}
+    for name in sorted(results.coords.keys()):
+        dists, coords = results.sorted_by_dist(name)
+        print('------------------------------------------------------------------------')
+        print('TOTAL', name, len(coords))
+        for dist, (x, y, z) in zip(dists.tolist(), coords.tolist()):
+            detail = details.get((x, y, z))
+            print(name, f'{dist:6} ({x:4} {y:4} {z:4})', *((detail, ) if detail else ()))
+
+def show_interesting_text_closest(results: ScanResults, details: Optional[dict[Coords, str]] = None):
+    details = details or {}
+    dists, names, coords = results.sorted_by_dist_all()
+
+    total = len(names)
+    print('------------------------------------------------------------------------')
+    print('TOTAL', total)
+    for dist, name, (x, y, z) in zip(dists.tolist(), names, coords.tolist()):
+        detail = details.get((x, y, z))
+        print(name, dist, '(', x, y, z, ')', *((detail, ) if detail else ()))
+
+
+def show_interesting_json(results: ScanResults):
+    print(json.dumps(get_interesting_json(results), indent=None))
+
+
+def show_clusters_text(results: ScanResults, gap: int = 1):
+    """
+    One line per cluster of blocks (see ScanResults.clustered()), closest first:
+    the distance to and position of its closest block, how many blocks it has,
+    its centroid and bounding box and the blocks in it
+    """
+    clusters = results.clustered(gap)
+    print('------------------------------------------------------------------------')
+    print('TOTAL', len(clusters), 'clusters of', len(results), 'blocks')
+    for cluster in clusters:
+        x, y, z = cluster.closest
+        (x_min, y_min, z_min), (x_max, y_max, z_max) = cluster.min, cluster.max
+        centroid = ' '.join(f'{value:.1f}' for value in cluster.centroid)
+        print(
+            f'{cluster.dist:6} ({x:4} {y:4} {z:4}) {cluster.count:5} blocks around ({centroid})'
+            f' in {x_min}..{x_max} {y_min}..{y_max} {z_min}..{z_max}:',
+            ', '.join(f'{name} {count}' for name, count in cluster.blocks.items()),
+        )
+
+
+def get_clusters_json(results: ScanResults, gap: int = 1) -> list[dict]:
+    return [
+        {
+            'dist': cluster.dist,
+            'closest': cluster.closest,
+            'centroid': [round(value, 2) for value in cluster.centroid],
+            'min': cluster.min,
+            'max': cluster.max,
+            'count': cluster.count,
+            'blocks': cluster.blocks,
+        }
+        for cluster in results.clustered(gap)
+    ]
+
+
+def show_clusters_json(results: ScanResults, gap: int = 1):
+    print(json.dumps(get_clusters_json(results, gap), indent=None))
+
+
+def get_interesting_json(results: ScanResults) -> dict:
+    ROUND = 1
+    data = {}
+    for block_name in results.coords:
+        buckets, _counts = results.grouped(block_name, ROUND)
+        # group the y values of each x,z column, columns in the order they were found
+        columns, first_index, column_index = np.unique(
+            buckets[:, [0, 2]], axis=0, return_index=True, return_inverse=True
+        )
+        column_index = column_index.reshape(-1)
+        ys = np.split(
+            buckets[np.argsort(column_index, kind='stable'), 1],
+            np.cumsum(np.bincount(column_index))[:-1],
+        )
+        order = np.argsort(first_index)
+        data[block_name] = {
+            f"{x},{z}": ys[i].tolist()
+            for i, (x, z) in zip(order.tolist(), columns[order].tolist())
+        }
+    return data
+
+
+def show_interesting_ndjson(
+    hits_iter: Iterator[Hits],
+    center: Coords,
+    file=None,
+    flush: bool = True,
+    stats: Optional[ScanStats] = None,
+    details: Optional[dict[Coords, str]] = None,
+):
+    """
+    Print one json object per block as each chunk's hits come in (so only
+    approximately closest first)
+    """
+    file = sys.stdout if file is None else file
+    stats = stats or ScanStats()
+    # json.dumps() per block is by far the slowest part of this; the names
+    # are the only thing that need escaping so do each of those just once
+    name_json: dict[BlockType, str] = {}
+    for hits in hits_iter:
+        with stats.time('output'):
+            found = []
+            for name, coords_list in hits.items():
+                if name not in name_json:
+                    name_json[name] = json.dumps(name)
+                for coords in coords_list:
+                    x, y, z = coords.T.tolist()
+                    found += zip(get_dists(coords, center).tolist(), [name] * len(x), x, y, z)
+            found.sort()
+            lines = [
+                f'{{"name": {name_json[name]}, "dist": {dist}, "x": {x}, "y": {y}, "z": {z}}}\n'
+                for dist, name, x, y, z in found
+            ]
+            if details:
+                lines = [
+                    f'{line[:-2]}, "details": {json.dumps(details[(x, y, z)])}}}\n' if details.get((x, y, z)) else line
+                    for line, (_dist, _name, x, y, z) in zip(lines, found)
+                ]
+            file.write(''.join(lines))
+            if flush:
+                file.flush()
+
+
+def write_npy(zip_file: zipfile.ZipFile, key: str, dtype: str, shape: Tuple[int, ...], data):
+    """
+    Add a .npy member to an .npz, copying its raw (C order) array data from
+    the file object `data` rather than needing it all in memory
+    """
+    with zip_file.open(f'{key}.npy', 'w', force_zip64=True) as member:
+        np.lib.format.write_array_header_1_0(member, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            'fortran_order': False,
+            'shape': shape,
+        })
+        data.seek(0)
+        shutil.copyfileobj(data, member)
+
+
+def show_interesting_npz(hits_iter: Iterator[Hits], center: Coords, file, stats: Optional[ScanStats] = None):
+    """
+    Write the hits as a numpy .npz with names, name (index into names), coords
+    and dist columns, spooling them to temp files as they come in
+    """
+    stats = stats or ScanStats()
+    names: dict[BlockType, int] = {}
+    count = 0
+    with tempfile.TemporaryFile() as name_data, tempfile.TemporaryFile() as coords_data, tempfile.TemporaryFile() as dist_data:
+        for hits in hits_iter:
+            with stats.time('output'):
+                for name, coords_list in hits.items():
+                    name_index = names.setdefault(name, len(names))
+                    for coords in coords_list:
+                        name_data.write(np.full(len(coords), name_index, dtype='<u2').tobytes())
+                        coords_data.write(coords.astype('<i4').tobytes())
+                        dist_data.write(get_dists(coords, center).astype('<f4').tobytes())
+                        count += len(coords)
+
+        with stats.time('output'), zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            with zip_file.open('names.npy', 'w') as member:
+                np.lib.format.write_array(member, np.array(list(names), dtype=str))
+            write_npy(zip_file, 'name', '<u2', (count, ), name_data)
+            write_npy(zip_file, 'coords', '<i4', (count, 3), coords_data)
+            write_npy(zip_file, 'dist', '<f4', (count, ), dist_data)
+
+
+@contextlib.contextmanager
+def open_output(path: Optional[Path], compression: Optional[str] = None, binary: bool = False):
+    """
+    Open --output (or stdout if there isn't one) for writing, optionally
+    compressed with 'gz' or 'zst'
+    """
+    if path is None and compression is None and not binary:
+        yield sys.stdout
+        return
+
+    with contextlib.ExitStack() as stack:
+        if path is None:
+            sys.stdout.flush()
+            raw = sys.stdout.buffer
+        else:
+            raw = stack.enter_context(path.open('wb'))
+        if compression == 'gz':
+            raw = stack.enter_context(gzip.GzipFile(fileobj=raw, mode='wb'))
+        elif compression == 'zst':
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception('zstd output needs the zstandard package (pip install zstandard)')
+            raw = stack.enter_context(zstandard.ZstdCompressor().stream_writer(raw, closefd=False))
+        elif compression is not None:
+            raise Exception(f'Unknown compression {compression}')
+
+        if binary:
+            yield raw
+        else:
+            text = io.TextIOWrapper(raw, encoding='utf-8')
+            yield text
+            # leave closing the underlying file to the exit stack
+            text.flush()
+            text.detach()
+
+
+def add_common_arguments(
+    parser: argparse.ArgumentParser,
+    dimension: bool = False,
+    index_dir: bool = False,
+    use_index: bool = False,
+    socket: bool = False,
+    use_server: bool = False,
+    output: bool = False,
+    stats: bool = False,
+):
+    """
+    The options shared by scan.py and its subcommands: the world and verbosity,
+    plus whichever of the others the command uses
+    """
+    parser.add_argument('--world', type=Path, default=None, help='World directory (default: worlds/<level_name> from settings.inc)')
+    parser.add_argument('--verbose', '-v', action='count', default=0, dest='log_level', help='Log progress (-v) or debugging detail (-vv)')
+    if dimension:
+        add_dimension_arguments(parser)
+    if index_dir:
+        parser.add_argument('--index-dir', type=Path, default=DEFAULT_INDEX_PATH, help='Where block indexes and chunk presence maps are kept')
+    if use_index:
+        parser.add_argument('--no-index', action='store_false', dest='use_index', help="Don't use the block index even if it exists")
+    if socket:
+        parser.add_argument('--socket', type=Path, default=DEFAULT_SOCKET_PATH, help='Socket of `scan.py serve`')
+    if use_server:
+        parser.add_argument('--no-server', action='store_false', dest='use_server', help="Don't forward the query to `scan.py serve` even if it's running")
+    if output:
+        parser.add_argument('--output', '-o', type=Path, default=None, help='Write the results here instead of stdout')
+    if stats:
+        parser.add_argument('--stats', nargs='?', const='table', choices=('table', 'json'), default=None, help='Show where the time went (to stderr)')
+
+
+def add_dimension_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--nether', action='store_const', const=1, dest='dimension', default=0)
+    parser.add_argument('--theend', action='store_const', const=2, dest='dimension')
+
+
+def add_query_arguments(parser: argparse.ArgumentParser):
+    """
+    The options that say what to look for and where; these are shared by
+    scan.py itself and each line of `scan.py batch`
+    """
+    parser.add_argument('center_x', type=str)
+    parser.add_argument('center_y', type=str)
+    parser.add_argument('center_z', type=str)
+    parser.add_argument('--ymin', type=int, default=None)
+    parser.add_argument('--ymax', type=int, default=None)
+    parser.add_argument('--dist', type=int, default=DEFAULT_MAX_DIST)
+    parser.add_argument('--up', action='store_true')
+    parser.add_argument('--down', action='store_true')
+    parser.add_argument('--ydist', type=int, default=None)
+    parser.add_argument('--north', action='store_true')
+    parser.add_argument('--south', action='store_true')
+    parser.add_argument('--east', action='store_true')
+    parser.add_argument('--west', action='store_true')
+    add_dimension_arguments(parser)
+    parser.add_argument('--nearest', type=parse_positive_int, default=None, metavar='N', help='Only find the N closest blocks, stopping as soon as they have been found')
+    parser.add_argument('--block', action='append', default=None, dest='block_names', metavar='NAME', help='Only look for this block (can be given more than once)')
+    parser.add_argument('--entities', action='store_true', help='Only find chests, spawners and brewing stands, using their block entity records rather than the terrain (much faster)')
+
+    # these replace the --dist box, but --north etc (and the y range) still cut them down; without
+    # --ymin/--ymax/--ydist a sphere or tunnel's y range is its own height
+    shapes = parser.add_mutually_exclusive_group()
+    shapes.add_argument('--sphere', type=float, default=None, metavar='RADIUS', help='Only search a ball of RADIUS around the center')
+    shapes.add_argument('--cylinder', type=float, default=None, metavar='RADIUS', help='Only search within RADIUS of the center horizontally')
+    shapes.add_argument(
+        '--tunnel',
+        type=parse_tunnel,
+        default=None,
+        metavar='HEADING,LENGTH,WIDTH[,END_WIDTH]',
+        help='Only search a level, round tunnel from the center along HEADING (degrees clockwise from north);'
+             ' with END_WIDTH it widens or narrows along its length into a cone',
+    )
+    shapes.add_argument(
+        '--polygon',
+        type=parse_polygon,
+        default=None,
+        metavar='X,Z:X,Z:...',
+        help='Only search the columns inside this polygon (use --polygon=... if the first x is negative)',
+    )
+
+    for opt in OPTIONAL_BLOCKS:
+        parser.add_argument(f'--{opt}', default=False, action='store_true')
+
+
+def parse_positive_int(text: str) -> int:
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'Expected a positive integer, got {value}')
+    return value
+
+
+def parse_non_negative_int(text: str) -> int:
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f'Expected zero or a positive integer, got {value}')
+    return value
+
+
+def parse_tunnel(text: str) -> Tuple[float, ...]:
+    values = tuple(float(value) for value in text.split(','))
+    if len(values) not in (3, 4):
+        raise argparse.ArgumentTypeError('Expected HEADING,LENGTH,WIDTH or HEADING,LENGTH,WIDTH,END_WIDTH')
+    if values[1] <= 0:
+        raise argparse.ArgumentTypeError('LENGTH must be positive')
+    return values
+
+
+def parse_polygon(text: str) -> list[Tuple[int, int]]:
+    corners = [tuple(int(value) for value in corner.split(',')) for corner in text.split(':')]
+    if len(corners) < 3 or any(len(corner) != 2 for corner in corners):
+        raise argparse.ArgumentTypeError('Expected at least 3 X,Z corners separated by :')
+    return corners
+
+
+def check_query_opts(opts: argparse.Namespace):
+    """
+    Validate the add_query_arguments() options, and fill in the center and y range
+    """
+    opts.center_x = int(opts.center_x.rstrip(','))
+    opts.center_y = int(opts.center_y.rstrip(','))
+    opts.center_z = int(opts.center_z.rstrip(','))
+
+    if opts.block_names:
+        opts.block_names = [name if ':' in name else f'minecraft:{name}' for name in opts.block_names]
+
+    if opts.east and opts.west:
+        raise Exception('--east and --west are mutually exclusive')
+    if opts.north and opts.south:
+        raise Exception('--north and --south are mutually exclusive')
+
+    # a sphere or tunnel has its own height, which the default y range would cut off
+    shape = get_shape(opts)
+    shape_y_bounds = shape.get_y_bounds() if shape is not None else None
+    if shape_y_bounds is not None and opts.ymin is None and opts.ymax is None and opts.ydist is None:
+        opts.ymin = max(shape_y_bounds[0], opts.center_y) if opts.up else shape_y_bounds[0]
+        opts.ymax = min(shape_y_bounds[1], opts.center_y) if opts.down else shape_y_bounds[1]
+
+    ymax_candidates = [
+        opts.ymax,
+        opts.center_y if opts.down else None,
+        opts.center_y + opts.ydist if opts.ydist is not None else None,
+        max(DEFAULT_Y_MAX, opts.center_y + DEFAULT_Y_DIST)
+    ]
+    opts.ymax = next(y for y in ymax_candidates if y is not None)
+    opts.ymax = min(opts.ymax, Y_MAX)
+
+    ymin_candidates = [
+        opts.ymin,
+        opts.center_y if opts.up else None,
+        opts.center_y - opts.ydist if opts.ydist is not None else None,
+        min(DEFAULT_Y_MIN, opts.center_y - DEFAULT_Y_DIST)
+    ]
+    opts.ymin = next(y for y in ymin_candidates if y is not None)
+    opts.ymin = max(Y_MIN, opts.ymin)
+
+
+def get_shape(opts: argparse.Namespace) -> Optional[QueryShape]:
+    center = (opts.center_x, opts.center_y, opts.center_z)
+    return (
+        SphereShape(center, opts.sphere) if opts.sphere is not None else
+        CylinderShape(center, opts.cylinder) if opts.cylinder is not None else
+        TunnelShape(center, *opts.tunnel) if opts.tunnel is not None else
+        PolygonShape(opts.polygon) if opts.polygon is not None else
+        None
+    )
+
+
+def get_query(opts: argparse.Namespace) -> dict:
+    """
+    The iter_scan() arguments for the add_query_arguments() options
+    """
+    center = (opts.center_x, opts.center_y, opts.center_z)
+    shape = get_shape(opts)
+    shape_y_bounds = shape.get_y_bounds() if shape is not None else None
+    if shape_y_bounds is not None:
+        y_min = max(shape_y_bounds[0], Y_MIN, opts.center_y if opts.up else Y_MIN)
+        y_max = min(shape_y_bounds[1], Y_MAX, opts.center_y if opts.down else Y_MAX)
+        if opts.ymin > y_min or opts.ymax < y_max:
+            logger.warning(f'The {shape} reaches y {y_min} to {y_max} but only y {opts.ymin} to {opts.ymax} is being searched')
+    if shape is not None:
+        (x_min, x_max), (z_min, z_max) = shape.get_bounds()
+    else:
+        x_min, x_max = opts.center_x - opts.dist, opts.center_x + opts.dist
+        z_min, z_max = opts.center_z - opts.dist, opts.center_z + opts.dist
+    if opts.east:
+        x_min = max(x_min, opts.center_x)
+    if opts.west:
+        x_max = min(x_max, opts.center_x)
+    if opts.south:
+        z_min = max(z_min, opts.center_z)
+    if opts.north:
+        z_max = min(z_max, opts.center_z)
+    # the box already covers all of a shape, so there's nothing for --dist to cut off
+    max_dist = opts.dist if shape is None else max(
+        opts.center_x - x_min, x_max - opts.center_x, opts.center_z - z_min, z_max - opts.center_z, 0
+    )
+
+    logger.info('Searching'
+       f' [{x_min}-{x_max}]'
+       f' [{opts.ymin}-{opts.ymax}]'
+       f' [{z_min}-{z_max}]'
+       + (f' within {shape}' if shape is not None else '')
+       )
+
+    return dict(
+        dimension=opts.dimension,
+        center=center,
+        x_range=(x_min, x_max),
+        y_range=(opts.ymin, opts.ymax),
+        z_range=(z_min, z_max),
+        max_dist=max_dist,
+        optional_blocks_chosen={ key: getattr(opts, key) for key in OPTIONAL_BLOCKS },
+        nearest=opts.nearest,
+        block_names=opts.block_names,
+        entities=opts.entities,
+        shape=shape,
+    )
+
+
+def parse():
+    parser = argparse.ArgumentParser()
+    add_query_arguments(parser)
+    add_common_arguments(parser, index_dir=True, use_index=True, socket=True, use_server=True, output=True, stats=True)
+    parser.add_argument('--json', action='store_const', default='text', const='json', dest='format')
+    parser.add_argument('--closest', action='store_const', default='text', const='text_closest', dest='format')
+    parser.add_argument('--ndjson', action='store_const', default='text', const='ndjson', dest='format', help='Stream one json object per block as they are found')
+    parser.add_argument('--format', choices=FORMATS, default='text', dest='format')
+    parser.add_argument(
+        '--cluster-gap',
+        type=int,
+        default=1,
+        metavar='N',
+        help='With --format clusters(_json), blocks up to N apart are in the same cluster',
+    )
+    parser.add_argument('--debug', type=str, default=None)
+    parser.add_argument('--jobs', '-j', type=parse_positive_int, default=1, help='Number of worker processes')
+    parser.add_argument(
+        '--prefetch',
+        type=parse_non_negative_int,
+        default=0,
+        metavar='N',
+        help='Read and decode up to N chunks ahead on background threads (0 to disable)',
+    )
+    parser.add_argument('--cache-mb', type=int, default=0, help='Memory budget for caching decoded chunks (0 to disable)')
+    parser.add_argument('--profile', type=Path, default=None, metavar='FILE', help='Dump cProfile stats to FILE')
+    parser.add_argument('--details', action='store_true', help='--entities, also showing chest contents and spawner mobs (text and ndjson formats)')
+
+    opts = parser.parse_args(sys.argv[1:])
+    if opts.world is None:
+        opts.world = get_default_world_path()
+    check_query_opts(opts)
+    opts.entities = opts.entities or opts.details
+    if opts.nearest is not None and opts.format == 'text':
+        opts.format = 'text_closest'
+
+    return opts
+
+def show_age(world_path: Path, file=None):
+    # reading the dir is not good because the act of opening the file
+    # sets a new modified timestamp
+    #world_db = Path(world_path, 'db')
+    #now = datetime.now()
+    #smallest_delta = None
+    #for f in world_db.iterdir():
+    #    if not f.is_file():
+    #        continue
+    #    t = datetime.fromtimestamp(f.stat().st_mtime)
+    #    delta = now - t
+    #    smallest_delta = delta if smallest_delta is None else min(smallest_delta, delta)
+
+    smallest_delta = datetime.now() - datetime.fromtimestamp(get_last_updated(world_path))
+    print('Last updated:', humanize.precisedelta(smallest_delta), file=file)
+    
+
+def run():
+    opts = parse()
+    global logger
+    logger = init_logger(opts.log_level)
+
+    if opts.debug:
+        if len(opts.debug.split(':') < 2):
+            opts.debug += ':58400'
+
+        debug_host, debug_port = opts.debug.split(':')
+
+        import pydevd_pycharm
+        pydevd_pycharm.settrace(
+            debug_host,
+            port=debug_port,
+            stdoutToServer=True,
+            stderrToServer=True
+        )
+
+    # a server can only pass text back
+    stdout_binary = opts.output is None and opts.format in BINARY_FORMATS
+    if opts.use_server and not stdout_binary and query_server(opts):
+        return
+
+    run_query(opts)
+
+
+def run_query(opts: argparse.Namespace, db=None, cache: Optional[ChunkCache] = None):
+    # keep stdout as pure ndjson (etc)
+    show_age(Path(opts.world), file=sys.stderr if opts.format in STREAM_FORMATS else None)
+
+    if cache is None and opts.cache_mb:
+        cache = ChunkCache(opts.cache_mb * 2**20)
+
+    stats = ScanStats(timing=opts.stats is not None)
+    started = time.perf_counter()
+    with profiled(opts.profile):
+        with stats.time('index'):
+            # only open the world to refresh the index; if the index can't answer
+            # the query then the scan opens it (when it isn't already)
+            if opts.use_index and is_index_stale(opts.index_dir, opts.world, opts.dimension):
+                with open_world_db(opts.world) if db is None else contextlib.nullcontext(db) as refresh_db:
+                    refresh_index(opts.index_dir, opts.world, opts.dimension, refresh_db)
+            index = BlockIndex.load(opts.index_dir, opts.world, opts.dimension) if opts.use_index else None
+            presence = ChunkPresence.load(opts.index_dir, opts.world, opts.dimension) if opts.use_index else None
+        query = dict(
+            get_query(opts),
+            world_path=opts.world,
+            jobs=opts.jobs,
+            prefetch=opts.prefetch,
+            index=index,
+            presence=presence,
+            db=db,
+            cache=cache,
+            stats=stats,
+            details={} if opts.details else None,
+        )
+        show_query(opts, query, stats)
+    if opts.stats is not None:
+        show_stats(stats, time.perf_counter() - started, opts.stats)
+
+
+def show_query(opts: argparse.Namespace, query: dict, stats: ScanStats):
+    """
+    Run the query, writing the results out in whichever format was asked for
+    """
+    if opts.format == 'npz':
+        with open_output(opts.output, binary=True) as output:
+            show_interesting_npz(iter_scan(**query), query['center'], output, stats)
+        return
+    if opts.format in STREAM_FORMATS:
+        _format, _dot, compression = opts.format.partition('.')
+        with open_output(opts.output, compression or None) as output:
+            # flushing a compressed stream after every chunk would wreck the compression
+            show_interesting_ndjson(
+                iter_scan(**query), query['center'], output, flush=not compression, stats=stats, details=query['details']
+            )
+        return
+
+    results = scan(**query)
+    show_fns = {
+        'text': functools.partial(show_interesting_text, details=query['details']),
+        'text_closest': functools.partial(show_interesting_text_closest, details=query['details']),
+        'json': show_interesting_json,
+        'clusters': functools.partial(show_clusters_text, gap=opts.cluster_gap),
+        'clusters_json': functools.partial(show_clusters_json, gap=opts.cluster_gap),
+    }
+    with stats.time('output'), open_output(opts.output) as output, contextlib.redirect_stdout(output):
+        show_fns[opts.format](results)
+
+
+# phases timed by --stats, in the order they happen
+STATS_PHASES = ('index', 'read', 'palette', 'unpack', 'classify', 'collect', 'output')
+STATS_COUNTS = (
+    'chunks', 'chunks_ungenerated', 'columns', 'subchunks', 'subchunks_skipped', 'blocks', 'hits', 'unrecognised', 'bytes_read',
+)
+
+
+def show_stats(stats: ScanStats, total: float, format: str):
+    """
+    Print the --stats summary (to stderr, so it doesn't get mixed up with the results)
+    """
+    seconds = {phase: stats.seconds[phase] for phase in STATS_PHASES}
+    seconds['total'] = total
+    counts = {name: stats.counts[name] for name in STATS_COUNTS}
+    if format == 'json':
+        print(json.dumps({'seconds': seconds, 'counts': counts}), file=sys.stderr)
+        return
+
+    # with --jobs or --prefetch the worker phases overlap, so they can add up to more than the total
+    other = total - sum(stats.seconds[phase] for phase in STATS_PHASES)
+    lines = ['------------------------------------------------------------------------']
+    for phase in STATS_PHASES:
+        lines.append(f'{phase:18} {seconds[phase]:9.3f}s {seconds[phase] / total:5.0%}')
+    if other > 0:
+        lines.append(f'{"other":18} {other:9.3f}s {other / total:5.0%}')
+    lines.append(f'{"total":18} {total:9.3f}s')
+    lines.append('')
+    for name in STATS_COUNTS:
+        value = humanize.naturalsize(counts[name], binary=True) if name == 'bytes_read' else f'{counts[name]:,}'
+        lines.append(f'{name:18} {value:>10}')
+    if total and counts['blocks']:
+        lines.append(f'{"blocks/sec":18} {counts["blocks"] / total:>10,.0f}')
+    print('\n'.join(lines), file=sys.stderr)
+
+
+@contextlib.contextmanager
+def profiled(path: Optional[Path]):
+    """
+    Run the enclosed code under cProfile and dump the stats to path (if given);
+    view them with `python -m pstats <path>`
+    """
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        logger.info(f'Wrote profile to {path}')
+
+
+def parse_index():
+    parser = argparse.ArgumentParser(prog=f'{sys.argv[0]} index', description='Build the block index for a world')
+    add_common_arguments(parser, dimension=True, index_dir=True)
+    parser.add_argument('--full', action='store_true', help='Rebuild from scratch rather than only rescanning changed chunks')
+    parser.add_argument(
+        '--presence-only',
+        action='store_true',
+        help='Only build the map of which chunks have been generated (for every dimension), not the block index',
+    )
+    opts = parser.parse_args(sys.argv[2:])
+    if opts.world is None:
+        opts.world = get_default_world_path()
+    return opts
+
+
+def run_index():
+    opts = parse_index()
+    global logger
+    logger = init_logger(opts.log_level)
+    show_age(Path(opts.world))
+    with open_world_db(opts.world) as db:
+        presences = ChunkPresence.build(opts.index_dir, opts.world, db)
+        print(
+            f'Found {", ".join(f"{len(presence.chunks)} chunks in dimension {dimension}" for dimension, presence in presences.items())}'
+            f' ({ChunkPresence.get_path(opts.index_dir, opts.world)})'
+        )
+        if opts.presence_only:
+            return
+        previous = None if opts.full else BlockIndex.open(opts.index_dir, opts.world, opts.dimension)
+        if previous is not None and not previous.is_compatible():
+            previous = None
+        index = BlockIndex.build(opts.index_dir, opts.world, opts.dimension, db, previous=previous)
+    print(f'Indexed {len(index.coords)} blocks ({len(index.names)} block types) into {index.path}')
+
+
+# ---------------------------------------------------------------------------
+# Batch queries
+#
+# `scan.py batch` runs many queries (one per line, each with the same options
+# as a normal scan.py query) in a single pass over the world, so chunks that
+# several queries overlap are only read and decoded once
+
+BATCH_FORMATS = ('text', 'text_closest', 'json', 'clusters', 'clusters_json', 'ndjson')
+
+
+def parse_batch():
+    parser = argparse.ArgumentParser(
+        prog=f'{sys.argv[0]} batch',
+        description='Run one query per line of FILE (or stdin), e.g. "989 15 55 --dist 40 --coal --name ladder"',
+    )
+    parser.add_argument('file', type=Path, nargs='?', default=None, help='Queries to run; - or omitted for stdin')
+    add_common_arguments(parser, index_dir=True, use_index=True, output=True, stats=True)
+    parser.add_argument('--format', choices=BATCH_FORMATS, default='text', dest='format')
+    parser.add_argument('--cluster-gap', type=int, default=1, metavar='N', help='With --format clusters(_json), blocks up to N apart are in the same cluster')
+    parser.add_argument('--profile', type=Path, default=None, metavar='FILE', help='Dump cProfile stats to FILE')
+    opts = parser.parse_args(sys.argv[2:])
+    if opts.world is None:
+        opts.world = get_default_world_path()
+    return opts
+
+
+def parse_batch_queries(lines: Iterator[str], source: str) -> list[Tuple[str, dict]]:
+    """
+    (name, get_query()) for each query line; blank lines and # comments are skipped
+
+    Each line takes the same options as a scan.py query, plus --name to label
+    its results (by default the line itself is used)
+    """
+    queries = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parser = argparse.ArgumentParser(prog=f'{source}:{line_number}', add_help=False)
+        add_query_arguments(parser)
+        parser.add_argument('--name', type=str, default=None)
+        opts = parser.parse_args(shlex.split(line))
+        check_query_opts(opts)
+        queries.append((opts.name or line, get_query(opts)))
+    return queries
+
+
+def run_batch():
+    opts = parse_batch()
+    global logger
+    logger = init_logger(opts.log_level)
+
+    if opts.file is None or str(opts.file) == '-':
+        queries = parse_batch_queries(sys.stdin, '<stdin>')
+    else:
+        with opts.file.open() as f:
+            queries = parse_batch_queries(f, str(opts.file))
+
+    show_age(Path(opts.world), file=sys.stderr if opts.format == 'ndjson' else None)
+    stats = ScanStats(timing=opts.stats is not None)
+    started = time.perf_counter()
+    with profiled(opts.profile):
+        all_results = scan_batch(
+            [query for _name, query in queries],
+            opts.world,
+            stats,
+            index_dir=opts.index_dir if opts.use_index else None,
+        )
+        with stats.time('output'), open_output(opts.output) as output, contextlib.redirect_stdout(output):
+            for (name, query), results in zip(queries, all_results):
+                show_batch_results(name, query, results, opts.format, opts.cluster_gap)
+    if opts.stats is not None:
+        show_stats(stats, time.perf_counter() - started, opts.stats)
+
+
+def show_batch_results(name: str, query: dict, results: ScanResults, format: str, cluster_gap: int = 1):
+    """
+    Print the results of one batch query, labelled with its name
+    """
+    if format == 'json':
+        print(json.dumps({'query': name, 'results': get_interesting_json(results)}))
+        return
+    if format == 'clusters_json':
+        print(json.dumps({'query': name, 'clusters': get_clusters_json(results, cluster_gap)}))
+        return
+    if format == 'ndjson':
+        name_json = json.dumps(name)
+        dists, names, coords = results.sorted_by_dist_all()
+        for dist, block_name, (x, y, z) in zip(dists.tolist(), names, coords.tolist()):
+            print(f'{{"query": {name_json}, "name": {json.dumps(block_name)}, "dist": {dist}, "x": {x}, "y": {y}, "z": {z}}}')
+        return
+
+    print('========================================================================')
+    print('QUERY', name)
+    show_fns = {
+        'text': show_interesting_text_closest if query['nearest'] is not None else show_interesting_text,
+        'text_closest': show_interesting_text_closest,
+        'clusters': functools.partial(show_clusters_text, gap=cluster_gap),
+    }
+    show_fns[format](results)
+
+
+# ---------------------------------------------------------------------------
+# Block census
+#
+# `scan.py census` counts every block (name and dv) in the world in a single
+# pass: per dimension, per y layer and per chunk. This is the quick way to
+# find blocks missing from INTERESTING / IGNORE / OPTIONAL_BLOCKS after a game
+# update, and to see how ores are distributed by y
+
+CENSUS_FORMATS = ('table', 'json')
+
+
+def get_block_category(name: BlockType) -> str:
+    """
+    Which of the block tables a name is in: interesting, ignore, its optional
+    group(s) or unrecognised
+    """
+    if name in IGNORE:
+        return 'ignore'
+    if name in INTERESTING:
+        return 'interesting'
+    groups = [group for group, blocks in OPTIONAL_BLOCKS.items() if name in blocks]
+    return '+'.join(groups) if groups else 'unrecognised'
+
+
+class BlockCensus:
+    """
+    Block counts for one dimension, per distinct (name, dv) "kind": per y and
+    per chunk (subchunks must arrive grouped by chunk)
+    """
+
+    def __init__(self):
+        self.kinds: dict[PaletteEntry, int] = {}
+        self.layers: dict[int, np.ndarray] = {}
+        self.chunk_rows: list[np.ndarray] = []
+        self.subchunks = 0
+        # kinds and their counts in each subchunk of the chunk being added
+        self.chunk: Optional[Tuple[int, int]] = None
+        self.chunk_kinds: list[np.ndarray] = []
+        self.chunk_counts: list[np.ndarray] = []
+
+    def add(self, chunk_x: int, chunk_z: int, subchunk_y: int, subchunk: SubChunk):
+        self.subchunks += 1
+        kind_ids = np.array([self.kinds.setdefault(entry, len(self.kinds)) for entry in subchunk.palette], dtype=np.intp)
+        palette_size = len(kind_ids)
+        # count of each palette index at each y: (palette_size, 16)
+        counts = np.bincount(
+            (subchunk.blocks.astype(np.intp) * CHUNK_SIZE + np.arange(CHUNK_SIZE)).reshape(-1),
+            minlength=palette_size * CHUNK_SIZE,
+        )[:palette_size * CHUNK_SIZE].reshape(palette_size, CHUNK_SIZE)
+
+        layer = self.layers.get(subchunk_y)
+        if layer is None or len(layer) < len(self.kinds):
+            grown = np.zeros((max(len(self.kinds), 2 * (0 if layer is None else len(layer))), CHUNK_SIZE), dtype=np.int64)
+            if layer is not None:
+                grown[:len(layer)] = layer
+            layer = self.layers[subchunk_y] = grown
+        np.add.at(layer, kind_ids, counts)
+
+        if (chunk_x, chunk_z) != self.chunk:
+            self.end_chunk()
+            self.chunk = (chunk_x, chunk_z)
+        self.chunk_kinds.append(kind_ids)
+        self.chunk_counts.append(counts.sum(axis=1))
+
+    def end_chunk(self):
+        if self.chunk is None:
+            return
+        counts = np.bincount(np.concatenate(self.chunk_kinds), weights=np.concatenate(self.chunk_counts)).astype(np.int64)
+        kinds = np.flatnonzero(counts)
+        self.chunk_rows.append(np.column_stack((
+            np.full(len(kinds), self.chunk[0]),
+            np.full(len(kinds), self.chunk[1]),
+            kinds,
+            counts[kinds],
+        )))
+        self.chunk = None
+        self.chunk_kinds = []
+        self.chunk_counts = []
+
+    def get_layer_counts(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (ys, counts) where counts is (kinds, len(ys)): the count of each kind at each y
+        """
+        subchunk_ys = sorted(self.layers)
+        ys = (np.arange(CHUNK_SIZE) + np.array(subchunk_ys, dtype=np.int64).reshape(-1, 1) * CHUNK_SIZE).reshape(-1)
+        counts = np.zeros((len(self.kinds), len(ys)), dtype=np.int64)
+        for column, subchunk_y in enumerate(subchunk_ys):
+            layer = self.layers[subchunk_y][:len(self.kinds)]
+            counts[:len(layer), column * CHUNK_SIZE:(column + 1) * CHUNK_SIZE] = layer
+        return ys, counts
+
+    def get_chunk_counts(self) -> np.ndarray:
+        """
+        (N, 4) chunk x, chunk z, kind, count; one row per kind found in each
+        chunk, sorted by kind then chunk
+        """
+        self.end_chunk()
+        if not self.chunk_rows:
+            return np.empty((0, 4), dtype=np.int64)
+        rows = np.concatenate(self.chunk_rows).astype(np.int64)
+        return rows[np.lexsort((rows[:, 1], rows[:, 0], rows[:, 2]))]
+
+
+def take_census(world_path: Path, dimensions: list[int], stats: ScanStats) -> dict[int, BlockCensus]:
+    """
+    A BlockCensus of each of the given dimensions, from a single pass over every
+    stored subchunk
+
+    Subchunks that were never stored (which are all air) aren't counted
+    """
+    censuses = {dimension: BlockCensus() for dimension in dimensions}
+    with open_world_db(world_path) as db:
+        records = iter_timed(bedrock.leveldb.iterate(db), stats, 'read')
+        for key, data in records:
+            parsed = parse_chunk_key(key)
+            if parsed is None:
+                continue
+            dimension, chunk_x, chunk_z, tag, subchunk_y = parsed
+            if tag != TAG_SUBCHUNK_PREFIX or dimension not in censuses:
+                continue
+            stats.counts['bytes_read'] += len(data)
+            with stats.time('palette'):
+                subchunk = SubChunk(data)
+            with stats.time('unpack'):
+                subchunk.blocks
+            with stats.time('classify'):
+                censuses[dimension].add(chunk_x, chunk_z, subchunk_y, subchunk)
+            stats.counts['subchunks'] += 1
+            stats.counts['blocks'] += SUBCHUNK_BLOCKS
+    return censuses
+
+
+def get_census_json(census: BlockCensus, by_chunk: bool = False) -> dict:
+    ys, layer_counts = census.get_layer_counts()
+    chunk_counts = census.get_chunk_counts()
+    # where each kind's rows start and end
+    kind_rows = np.searchsorted(chunk_counts[:, 2], np.arange(len(census.kinds) + 1))
+    totals = layer_counts.sum(axis=1)
+    blocks = []
+    for (name, dv), kind in sorted(census.kinds.items(), key=lambda item: -totals[item[1]]):
+        in_kind = chunk_counts[kind_rows[kind]:kind_rows[kind + 1]]
+        block = {
+            'name': name,
+            'dv': dv,
+            'category': get_block_category(name),
+            'count': int(totals[kind]),
+            'chunks': len(in_kind),
+            'layers': {str(y): count for y, count in zip(ys.tolist(), layer_counts[kind].tolist()) if count},
+        }
+        if by_chunk:
+            block['by_chunk'] = {f'{x},{z}': count for x, z, _kind, count in in_kind.tolist()}
+        blocks.append(block)
+    return {
+        'chunks': len(np.unique(chunk_counts[:, :2], axis=0)),
+        'subchunks': census.subchunks,
+        'blocks': blocks,
+    }
+
+
+def show_census_table(dimension: int, census: dict, block_names: Optional[list[BlockType]] = None):
+    print('------------------------------------------------------------------------')
+    print(f'DIMENSION {dimension}: {census["chunks"]:,} chunks, {census["subchunks"]:,} subchunks')
+    print(f'{"name":40} {"dv":18} {"category":14} {"count":>14} {"chunks":>8} {"y range":>10} {"peak y":>6}')
+    for block in census['blocks']:
+        ys = [int(y) for y in block['layers']]
+        peak_y = max(block['layers'].items(), key=lambda item: item[1])[0] if ys else ''
+        y_range = f'{min(ys)}:{max(ys)}' if ys else ''
+        print(
+            f'{block["name"]:40} {block["dv"] or "":18} {block["category"]:14}'
+            f' {block["count"]:>14,} {block["chunks"]:>8,} {y_range:>10} {peak_y:>6}'
+        )
+
+    for name in block_names or ():
+        layers = Counter()
+        for block in census['blocks']:
+            if block['name'] == name:
+                layers.update(block['layers'])
+        print('------------------------------------------------------------------------')
+        print('LAYERS', name, sum(layers.values()))
+        for y, count in sorted(layers.items(), key=lambda item: int(item[0])):
+            print(f'{y:>6} {count:>10,}')
+
+
+def parse_census():
+    parser = argparse.ArgumentParser(prog=f'{sys.argv[0]} census', description='Count every block in the world, per dimension, y layer and chunk')
+    add_common_arguments(parser, output=True, stats=True)
+    parser.add_argument('--dimensions', type=parse_int_list, default=[0, 1, 2], help='Comma separated dimension numbers (default 0,1,2)')
+    parser.add_argument('--format', choices=CENSUS_FORMATS, default='table', dest='format')
+    parser.add_argument('--block', action='append', default=None, dest='block_names', metavar='NAME', help='Also show the count per y of this block (table format)')
+    parser.add_argument('--by-chunk', action='store_true', help='Include the count per chunk of every block (json format)')
+    opts = parser.parse_args(sys.argv[2:])
+    if opts.world is None:
+        opts.world = get_default_world_path()
+    if opts.block_names:
+        opts.block_names = [name if ':' in name else f'minecraft:{name}' for name in opts.block_names]
+    return opts
+
+
+def run_census():
+    opts = parse_census()
+    global logger
+    logger = init_logger(opts.log_level)
+    show_age(Path(opts.world), file=sys.stderr)
+
+    stats = ScanStats(timing=opts.stats is not None)
+    started = time.perf_counter()
+    censuses = take_census(opts.world, opts.dimensions, stats)
+    with stats.time('output'), open_output(opts.output) as output:
+        data = {
+            str(dimension): get_census_json(census, by_chunk=opts.by_chunk)
+            for dimension, census in censuses.items()
+        }
+        if opts.format == 'json':
+            json.dump(data, output)
+            output.write('\n')
+        else:
+            with contextlib.redirect_stdout(output):
+                for dimension, census in data.items():
+                    show_census_table(int(dimension), census, opts.block_names)
+    if opts.stats is not None:
+        show_stats(stats, time.perf_counter() - started, opts.stats)
+
+
+# ---------------------------------------------------------------------------
+# Query server
+#
+# `scan.py serve` keeps the world open (and a cache of decoded subchunks warm)
+# between queries. Each request is a single line of JSON holding the client's
+# parsed command line options and the response is a single line of JSON
+# holding whatever the CLI would have printed
+
+# options that need converting back to a Path when received by the server
+PATH_OPTIONS = ('world', 'index_dir', 'socket', 'output', 'profile')
+
+
+class ScanServer(socketserver.UnixStreamServer):
+
+    def __init__(self, socket_path: Path, world_path: Path, cache: ChunkCache):
+        self.world_path = world_path.resolve()
+        self.cache = cache
+        self.db = None
+        self.db_context = contextlib.ExitStack()
+        self.last_updated = None
+        super().__init__(str(socket_path), ScanRequestHandler)
+
+    def get_db(self):
+        # go.sh replaces the snapshot every time it's run
+        last_updated = get_last_updated(self.world_path)
+        if self.db is None or last_updated != self.last_updated:
+            if self.db is not None:
+                logger.info('World has been updated; reopening')
+            self.db_context.close()
+            self.cache.clear()
+            self.db = self.db_context.enter_context(open_world_db(self.world_path))
+            self.last_updated = last_updated
+        return self.db
+
+    def server_close(self):
+        super().server_close()
+        self.db_context.close()
+
+
+class ResponseStream(io.TextIOBase):
+    """
+    File-like object that sends whatever is written to it back to the client
+    as `{key: text}` lines; text is buffered until flush() (or until there's a
+    decent amount of it) so that a stream of print()s doesn't become a stream
+    of tiny messages
+    """
+    FLUSH_SIZE = 64 * 1024
+
+    def __init__(self, wfile, key: str):
+        self.wfile = wfile
+        self.key = key
+        self.buffer: list[str] = []
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.FLUSH_SIZE:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            message = {self.key: ''.join(self.buffer)}
+            self.buffer = []
+            self.size = 0
+            self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ScanRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        opts = argparse.Namespace(**json.loads(self.rfile.readline()))
+        for key in PATH_OPTIONS:
+            if getattr(opts, key) is not None:
+                setattr(opts, key, Path(getattr(opts, key)))
+
+        if opts.world.resolve() != self.server.world_path:
+            response = {'error': f'Server is for {self.server.world_path}', 'fallback': True}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            return
+
+        # output (and anything logged while running the query) is passed back
+        # to the client as it's produced
+        output = ResponseStream(self.wfile, 'output')
+        log_output = ResponseStream(self.wfile, 'log')
+        log_handler = logging.StreamHandler(log_output)
+        log_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        # the client gets what its -v asked for, the server's own log what the server's did
+        client_level = get_log_level(opts.log_level)
+        server_level = logger.level
+        log_handler.setLevel(client_level)
+        logger.setLevel(min(client_level, logger.getEffectiveLevel()))
+        logger.addHandler(log_handler)
+        response = {'done': True}
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(log_output):
+                run_query(opts, db=self.server.get_db(), cache=self.server.cache)
+        except BrokenPipeError:
+            logger.removeHandler(log_handler)
+            logger.setLevel(server_level)
+            logger.info('Client went away')
+            return
+        except Exception as e:
+            logger.exception('Query failed')
+            response['error'] = str(e)
+        finally:
+            logger.removeHandler(log_handler)
+            logger.setLevel(server_level)
+        output.flush()
+        log_output.flush()
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+def query_server(opts: argparse.Namespace) -> bool:
+    """
+    Forward a query to a running `scan.py serve` and print the result as it
+    comes back
+
+    Returns False if there's no server running (or it's for a different world)
+    """
+    if not opts.socket.exists():
+        return False
+
+    request = {
+        key: str(value.resolve()) if isinstance(value, Path) else value
+        for key, value in vars(opts).items()
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(opts.socket))
+        except (ConnectionRefusedError, FileNotFoundError):
+            # left behind by a server that has gone away
+            logger.info(f'No server listening on {opts.socket}')
+            return False
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+        received = False
+        for line in sock.makefile('rb'):
+            received = True
+            response = json.loads(line)
+            if response.get('fallback'):
+                logger.info(f'Not using server: {response["error"]}')
+                return False
+            if 'log' in response:
+                sys.stderr.write(response['log'])
+                sys.stderr.flush()
+            if 'output' in response:
+                sys.stdout.write(response['output'])
+                sys.stdout.flush()
+            if 'error' in response:
+                raise Exception(f'Server error: {response["error"]}')
+            if response.get('done'):
+                return True
+
+    if not received:
+        return False
+    # the server went away part way through (and some output may already
+    # have been shown, so it's too late to fall back to running it here)
+    raise Exception('Server closed the connection without finishing the query')
+
+
+def parse_serve():
+    parser = argparse.ArgumentParser(prog=f'{sys.argv[0]} serve', description='Answer scan queries with the world kept open')
+    add_common_arguments(parser, socket=True)
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_SERVE_CACHE_MB, help='Memory budget for decoded chunks')
+    opts = parser.parse_args(sys.argv[2:])
+    if opts.world is None:
+        opts.world = get_default_world_path()
+    return opts
+
+
+def run_serve():
+    opts = parse_serve()
+    global logger
+    logger = init_logger(opts.log_level)
+    # a request may lower the logger's level for its client's -v; keep that out of the server's own log
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(get_log_level(opts.log_level))
+
+    if opts.socket.exists():
+        opts.socket.unlink()
+    server = ScanServer(opts.socket, opts.world, ChunkCache(opts.cache_mb * 2**20))
+    logger.warning(f'Serving {server.world_path} on {opts.socket}')
+    # make sure the socket gets cleaned up when run as a service
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        opts.socket.unlink(missing_ok=True)
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+#
+# `scan.py bench` writes a synthetic world (in the same leveldb format the
+# game uses) and times scan() over a matrix of query settings. It can also
+# time the original block by block world.getBlock() approach over the same
+# queries as a reference
+
+BENCH_SUBCHUNKS_Y = range(-4, 8)
+BENCH_FILLER_FRACTION = 0.2
+BENCH_BITS = (1, 2, 3, 4, 5, 6, 8, 16)
+
+
+def encode_nbt_string(text: str) -> bytes:
+    data = text.encode('utf-8')
+    return UINT16.pack(len(data)) + data
+
+
+def encode_palette_entry(name: BlockType) -> bytes:
+    """
+    A palette entry as stored in a (version 8+) subchunk: a little endian NBT
+    compound with a name, empty states and a version
+    """
+    return b''.join((
+        bytes([NBT_COMPOUND]), encode_nbt_string(''),
+        bytes([NBT_STRING]), encode_nbt_string('name'), encode_nbt_string(name),
+        bytes([NBT_COMPOUND]), encode_nbt_string('states'), bytes([NBT_END]),
+        bytes([3]), encode_nbt_string('version'), INT32.pack(17959425),
+        bytes([NBT_END]),
+    ))
+
+
+def encode_block_entity(entity_id: str, x: int, y: int, z: int) -> bytes:
+    """
+    A block entity as stored in a chunk's TAG_BLOCK_ENTITY record: a little
+    endian NBT compound with an id and position, plus a spawner's mob or a
+    container's items
+    """
+    fields = [
+        bytes([NBT_STRING]), encode_nbt_string('id'), encode_nbt_string(entity_id),
+        bytes([3]), encode_nbt_string('x'), INT32.pack(x),
+        bytes([3]), encode_nbt_string('y'), INT32.pack(y),
+        bytes([3]), encode_nbt_string('z'), INT32.pack(z),
+    ]
+    if entity_id == 'MobSpawner':
+        fields += [bytes([NBT_STRING]), encode_nbt_string('EntityIdentifier'), encode_nbt_string('minecraft:zombie')]
+    else:
+        fields += [
+            bytes([NBT_LIST]), encode_nbt_string('Items'), bytes([NBT_COMPOUND]), INT32.pack(1),
+            bytes([NBT_STRING]), encode_nbt_string('Name'), encode_nbt_string('minecraft:bread'),
+            bytes([1]), encode_nbt_string('Count'), bytes([1]),
+            bytes([NBT_END]),
+        ]
+    return b''.join((bytes([NBT_COMPOUND]), encode_nbt_string(''), *fields, bytes([NBT_END])))
+
+
+def encode_subchunk(palette: list[BlockType], blocks: np.ndarray) -> bytes:
+    """
+    Encode a (16, 16, 16) x,z,y array of palette indices as a version 8 subchunk
+    record with a single block storage
+    """
+    if len(palette) == 1:
+        bits = 0
+        words = b''
+    else:
+        bits = next(bits for bits in BENCH_BITS if 1 << bits >= len(palette))
+        blocks_per_word = 32 // bits
+        word_count = -(-SUBCHUNK_BLOCKS // blocks_per_word)
+        padded = np.zeros(word_count * blocks_per_word, dtype=np.uint64)
+        padded[:SUBCHUNK_BLOCKS] = blocks.reshape(-1)
+        shifts = (np.arange(blocks_per_word, dtype=np.uint64) * np.uint64(bits))
+        words = (padded.reshape(word_count, blocks_per_word) << shifts).sum(axis=1).astype('<u4').tobytes()
+    return b''.join((
+        bytes([8, 1, bits << 1]),
+        words,
+        INT32.pack(len(palette)),
+        *(encode_palette_entry(name) for name in palette),
+    ))
+
+
+def generate_world(
+    world_path: Path,
+    radius: int,
+    ore_density: float,
+    palette_size: int,
+    dimensions: list[int],
+    seed: int = 0,
+):
+    """
+    Write a synthetic world of (2 * radius + 1)^2 chunks around 0,0 in each
+    dimension, scattered with interesting blocks at ore_density
+    """
+    rng = np.random.default_rng(seed)
+    entity_ids = {block: entity_id for entity_id, block in BLOCK_ENTITY_BLOCKS.items()}
+    fillers = sorted(IGNORE - {'minecraft:stone', 'minecraft:deepslate', 'minecraft:netherrack'})
+    ores = sorted(INTERESTING.union(*OPTIONAL_BLOCKS.values()))
+
+    (world_path / 'db').mkdir(parents=True, exist_ok=True)
+    import_bedrock()
+    db = bedrock.leveldb.open(str(world_path / 'db'))
+    try:
+        for dimension in dimensions:
+            for chunk_x in range(-radius, radius + 1):
+                for chunk_z in range(-radius, radius + 1):
+                    bedrock.leveldb.put(db, chunk_key(chunk_x, chunk_z, dimension, TAG_VERSION), bytes([40]))
+                    block_entities = []
+                    for subchunk_y in BENCH_SUBCHUNKS_Y:
+                        base = (
+                            'minecraft:netherrack' if dimension == 1 else
+                            'minecraft:deepslate' if subchunk_y < 0 else
+                            'minecraft:stone'
+                        )
+                        palette = [base] + rng.choice(fillers, size=palette_size - 1, replace=False).tolist()
+                        blocks = np.zeros(SUBCHUNK_BLOCKS, dtype=np.int64)
+                        is_filler = rng.random(SUBCHUNK_BLOCKS) < BENCH_FILLER_FRACTION
+                        blocks[is_filler] = rng.integers(0, len(palette), size=np.count_nonzero(is_filler))
+
+                        ore_positions = np.flatnonzero(rng.random(SUBCHUNK_BLOCKS) < ore_density)
+                        if len(ore_positions):
+                            ore_names = rng.choice(ores, size=len(ore_positions)).tolist()
+                            ore_palette = sorted(set(ore_names))
+                            blocks[ore_positions] = [len(palette) + ore_palette.index(name) for name in ore_names]
+                            palette += ore_palette
+                            for position, name in zip(ore_positions.tolist(), ore_names):
+                                if name in entity_ids:
+                                    # blocks are indexed [x][z][y]
+                                    block_entities.append(encode_block_entity(
+                                        entity_ids[name],
+                                        chunk_x * CHUNK_SIZE + position // (CHUNK_SIZE * CHUNK_SIZE),
+                                        subchunk_y * CHUNK_SIZE + position % CHUNK_SIZE,
+                                        chunk_z * CHUNK_SIZE + position // CHUNK_SIZE % CHUNK_SIZE,
+                                    ))
+
+                        bedrock.leveldb.put(
+                            db,
+                            chunk_key(chunk_x, chunk_z, dimension, TAG_SUBCHUNK_PREFIX, subchunk_y),
+                            encode_subchunk(palette, blocks.reshape(CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE)),
+                        )
+                    if block_entities:
+                        bedrock.leveldb.put(
+                            db, chunk_key(chunk_x, chunk_z, dimension, TAG_BLOCK_ENTITY), b''.join(block_entities)
+                        )
+    finally:
+        bedrock.leveldb.close(db)
+    (world_path / 'last_updated').touch()
+
+
+def scan_reference(
+    world_path: Path,
+    dimension: int,
+    center: Coords,
+    x_range: Tuple[int, int],
+    y_range: Tuple[int, int],
+    z_range: Tuple[int, int],
+    interesting_blocks: set[BlockType],
+    ignore_blocks: set[BlockType],
+) -> ScanResults:
+    """
+    Find the interesting blocks in the given (inclusive) ranges the way this
+    script originally did it: one world.getBlock() per block
+    """
+    x_min, x_max = x_range
+    y_min, y_max = y_range
+    z_min, z_max = z_range
+    found = defaultdict(list)
+    import_bedrock()
+    with bedrock.World(str(world_path)) as world:
+        for x in range(x_min, x_max + 1):
+            for z in range(z_min, z_max + 1):
+                for y in range(y_min, y_max + 1):
+                    block = world.getBlock(x, y, z, dimension=dimension)
+                    if block is None or block.name in ignore_blocks:
+                        continue
+                    if block.name in interesting_blocks:
+                        found[canonical_name(block.name)].append((x, y, z))
+    results = ScanResults(center)
+    for name, coords in found.items():
+        results.add(name, np.array(coords, dtype=np.int32))
+    return results
+
+
+def time_startup(args: list[str], runs: int) -> float:
+    """
+    Fastest of `runs` runs of `scan.py args`, each in a new interpreter, in seconds
+    """
+    fastest = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, __file__, *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - started
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+    return fastest
+
+
+def time_bench_run(engine: str, repeat: int, **query) -> Tuple[float, int, str, int]:
+    """
+    (fastest seconds, result count, ScanResults.get_digest(), peak RSS) of `repeat`
+    runs of one bench engine; run_bench() runs this in a fresh process
+    """
+    seconds = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        if engine == 'reference':
+            results = scan_reference(
+                query['world_path'],
+                query['dimension'],
+                query['center'],
+                query['x_range'],
+                query['y_range'],
+                query['z_range'],
+                *get_block_sets(query['optional_blocks_chosen']),
+            )
+        else:
+            results = scan(**query)
+        elapsed = time.perf_counter() - started
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return seconds, len(results), results.get_digest(), get_peak_rss()
+
+
+def get_peak_rss() -> int:
+    """
+    High water mark of this process (plus any finished worker processes), in bytes
+    """
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # linux reports KiB, macos bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def parse_int_list(text: str) -> list[int]:
+    return [int(value) for value in text.split(',')]
+
+
+def parse_y_ranges(text: str) -> list[Tuple[int, int]]:
+    return [tuple(int(y) for y in y_range.split(':', 1)) for y_range in text.split(',')]
+
+
+def parse_group_sets(text: str) -> list[list[BlockGroupType]]:
+    group_sets = []
+    for group_set in text.split(','):
+        groups = [] if group_set == 'none' else list(OPTIONAL_BLOCKS) if group_set == 'all' else group_set.split('+')
+        for group in groups:
+            if group not in OPTIONAL_BLOCKS:
+                raise argparse.ArgumentTypeError(f'Unknown block group {group}')
+        group_sets.append(groups)
+    return group_sets
+
+
+def parse_bench():
+    parser = argparse.ArgumentParser(prog=f'{sys.argv[0]} bench', description='Time scans of a synthetic (or existing) world')
+    parser.add_argument('--world', type=Path, default=None, help='Benchmark this world instead of generating one')
+    parser.add_argument('--keep', type=Path, default=None, metavar='DIR', help='Generate the world here and keep it afterwards')
+    parser.add_argument('--radius', type=int, default=8, help='Generated world radius, in chunks')
+    parser.add_argument('--ore-density', type=float, default=0.002, help='Fraction of generated blocks that are interesting/optional')
+    parser.add_argument('--palette-size', type=int, default=6, help='Number of different (ignored) blocks in each generated subchunk')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--center', type=parse_int_list, default=[0, 0, 0], help='x,y,z')
+    parser.add_argument('--dists', type=parse_int_list, default=[16, 32, 64])
+    parser.add_argument('--y-ranges', type=parse_y_ranges, default=[(DEFAULT_Y_MIN, DEFAULT_Y_MAX)], help='Comma separated min:max')
+    parser.add_argument('--dimensions', type=parse_int_list, default=[0])
+    parser.add_argument('--groups', type=parse_group_sets, default=[[]], help='Comma separated sets of optional block groups, each "none", "all" or joined with +')
+    parser.add_argument('--jobs', type=parse_int_list, default=[1])
+    parser.add_argument('--prefetch', type=parse_int_list, default=[0], help='Comma separated --prefetch depths to try (with -j1)')
+    parser.add_argument('--repeat', type=int, default=1, help='Run each query this many times and keep the fastest')
+    parser.add_argument('--reference', action='store_true', help='Also time the original block by block getBlock() scan (slow)')
+    parser.add_argument('--startup', type=int, default=0, metavar='RUNS', help='Also time starting scan.py from scratch (fastest of RUNS runs)')
+    parser.add_argument('--output', '-o', type=Path, default=None)
+    parser.add_argument('--verbose', '-v', action='count', default=0, dest='log_level')
+    return parser.parse_args(sys.argv[2:])
+
+
+def run_bench():
+    opts = parse_bench()
+    global logger
+    logger = init_logger(opts.log_level)
+
+    with contextlib.ExitStack() as stack:
+        world = {}
+        if opts.world is not None:
+            world_path = opts.world
+        else:
+            world_path = opts.keep or Path(stack.enter_context(tempfile.TemporaryDirectory(prefix='mc-scan-bench-')))
+            world = {
+                'radius': opts.radius,
+                'ore_density': opts.ore_density,
+                'palette_size': opts.palette_size,
+                'seed': opts.seed,
+            }
+            # the generated world is centered on 0,0
+            if max(opts.dists) + max(abs(opts.center[0]), abs(opts.center[2])) > opts.radius * CHUNK_SIZE:
+                raise Exception(f'--dists and --center must stay within {opts.radius * CHUNK_SIZE} blocks of 0,0 with --radius {opts.radius}')
+            logger.warning(f'Generating world in {world_path}')
+            started = time.perf_counter()
+            generate_world(world_path, opts.radius, opts.ore_density, opts.palette_size, opts.dimensions, opts.seed)
+            world['generate_seconds'] = time.perf_counter() - started
+        world['path'] = str(world_path)
+
+        runs = []
+        center = tuple(opts.center)
+        for dimension in opts.dimensions:
+            for y_range in opts.y_ranges:
+                for groups in opts.groups:
+                    optional_blocks_chosen = {group: group in groups for group in OPTIONAL_BLOCKS}
+                    for dist in opts.dists:
+                        x_range = (center[0] - dist, center[0] + dist)
+                        z_range = (center[2] - dist, center[2] + dist)
+                        settings = {
+                            'dimension': dimension,
+                            'y_range': list(y_range),
+                            'groups': groups,
+                            'dist': dist,
+                        }
+                        chunks = sum(len(ring_chunks) for _ring, ring_chunks in iter_chunk_rings(center, x_range, z_range))
+                        blocks = (2 * dist + 1) ** 2 * (y_range[1] - y_range[0] + 1)
+
+                        engines = [('scan', jobs, 0) for jobs in opts.jobs]
+                        engines += [('scan', 1, prefetch) for prefetch in opts.prefetch if prefetch]
+                        if opts.reference:
+                            engines.append(('reference', 1, 0))
+                        scan_digest = None
+                        for engine, jobs, prefetch in engines:
+                            # a fresh process each, so the peak RSS is just this configuration's
+                            with concurrent_futures.ProcessPoolExecutor(
+                                max_workers=1,
+                                mp_context=multiprocessing.get_context('spawn'),
+                                initializer=init_worker,
+                                initargs=(logger.getEffectiveLevel(), ),
+                            ) as pool:
+                                seconds, results, digest, peak_rss = pool.submit(
+                                    time_bench_run,
+                                    engine,
+                                    opts.repeat,
+                                    dimension=dimension,
+                                    center=center,
+                                    x_range=x_range,
+                                    y_range=y_range,
+                                    z_range=z_range,
+                                    max_dist=dist,
+                                    world_path=world_path,
+                                    optional_blocks_chosen=optional_blocks_chosen,
+                                    jobs=jobs,
+                                    prefetch=prefetch,
+                                ).result()
+                            run = dict(
+                                settings,
+                                engine=engine,
+                                jobs=jobs,
+                                prefetch=prefetch,
+                                seconds=seconds,
+                                chunks=chunks,
+                                blocks=blocks,
+                                results=results,
+                                chunks_per_sec=chunks / seconds,
+                                blocks_per_sec=blocks / seconds,
+                                results_per_sec=results / seconds,
+                                peak_rss_mb=peak_rss / 2**20,
+                            )
+                            # compare what was found, not just how much
+                            if engine == 'reference':
+                                run['matches_scan'] = digest == scan_digest
+                            else:
+                                scan_digest = digest
+                            logger.info(f'{engine} -j{jobs} --prefetch {prefetch} dist={dist} y={y_range} dim={dimension} groups={"+".join(groups) or "none"}: {seconds:.3f}s')
+                            runs.append(run)
+
+        startup = {}
+        if opts.startup:
+            logger.info('Timing startup')
+            startup['help_seconds'] = time_startup(['--help'], opts.startup)
+            startup['tiny_scan_seconds'] = time_startup(
+                [*map(str, center), '--dist', '2', '--world', str(world_path), '--no-index', '--no-server'],
+                opts.startup,
+            )
+
+    with open_output(opts.output) as output:
+        json.dump({'world': world, 'runs': runs, 'startup': startup}, output, indent=2)
+        output.write('\n')
+
+
+COMMANDS = {
+    'index': run_index,
+    'serve': run_serve,
+    'bench': run_bench,
+    'batch': run_batch,
+    'census': run_census,
+}
 
 if __name__ == '__main__':
-    run()
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]]()
+    else:
+        run()
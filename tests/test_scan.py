@@ -0,0 +1,418 @@
+"""
+Regression tests for scan.py, run against small synthetic worlds (see generate_world())
+
+    python -m unittest discover tests
+
+The tests that read a world are skipped if the bedrock library isn't checked out
+"""
+import collections
+import contextlib
+import io
+import math
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Tuple
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import scan  # noqa: E402
+
+scan.logger = scan.init_logger(0)
+
+RADIUS = 2
+
+
+def get_bedrock():
+    try:
+        return scan.import_bedrock()
+    except (RuntimeError, ImportError) as e:
+        raise unittest.SkipTest(f'bedrock library not available: {e}')
+
+
+def scan_world(world_path: Path, center=(0, 0, 0), dist=RADIUS * scan.CHUNK_SIZE, **kwargs) -> scan.ScanResults:
+    return scan.scan(
+        dimension=0,
+        center=center,
+        x_range=(center[0] - dist, center[0] + dist),
+        y_range=(scan.Y_MIN, scan.Y_MAX),
+        z_range=(center[2] - dist, center[2] + dist),
+        max_dist=dist,
+        world_path=world_path,
+        optional_blocks_chosen={group: True for group in scan.OPTIONAL_BLOCKS},
+        **kwargs,
+    )
+
+
+def run_cli(args: list[str]) -> str:
+    """
+    What `scan.py ARGS` prints (without going via a server)
+    """
+    with mock.patch.object(sys, 'argv', ['scan.py', *args, '--no-server']):
+        opts = scan.parse()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        scan.run_query(opts)
+    # drop the "Last updated" line
+    return output.getvalue().split('\n', 1)[1]
+
+
+def mark_updated(world_path: Path):
+    # go.sh touches last_updated after each snapshot; make sure the mtime moves
+    last_updated = scan.get_last_updated(world_path) + 10
+    os.utime(world_path / 'last_updated', (last_updated, last_updated))
+
+
+class WorldTestCase(unittest.TestCase):
+    """
+    Tests that only read a world share one (with some of every interesting block)
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bedrock = get_bedrock()
+        cls.tmp = tempfile.TemporaryDirectory(prefix='mc-scan-test-')
+        cls.world_path = Path(cls.tmp.name) / 'world'
+        scan.generate_world(cls.world_path, RADIUS, ore_density=0.01, palette_size=4, dimensions=[0, 1], seed=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+
+def get_blocks(results: scan.ScanResults) -> set[Tuple[str, int, int, int]]:
+    return {(name, *xyz) for name, coords in results.coords.items() for xyz in coords.tolist()}
+
+
+class ScanTest(WorldTestCase):
+
+    def test_matches_reference(self):
+        # the original one world.getBlock() per block scan
+        center = (5, 0, -3)
+        x_range, y_range, z_range = (-6, 16), (-20, 20), (-14, 8)
+        for dimension in (0, 1):
+            for groups in ((), tuple(scan.OPTIONAL_BLOCKS)):
+                optional_blocks_chosen = {group: group in groups for group in scan.OPTIONAL_BLOCKS}
+                expected = scan.scan_reference(
+                    self.world_path, dimension, center, x_range, y_range, z_range, *scan.get_block_sets(optional_blocks_chosen)
+                )
+                found = scan.scan(
+                    dimension=dimension,
+                    center=center,
+                    x_range=x_range,
+                    y_range=y_range,
+                    z_range=z_range,
+                    max_dist=11,
+                    world_path=self.world_path,
+                    optional_blocks_chosen=optional_blocks_chosen,
+                )
+                self.assertGreater(len(expected), 0)
+                self.assertEqual(get_blocks(found), get_blocks(expected))
+
+
+class NearestTest(WorldTestCase):
+
+    def test_nearest_are_closest(self):
+        center = (4, -30, 7)
+        everything = scan_world(self.world_path, center=center, dist=30)
+        dists = np.sort(np.concatenate(list(everything.dists.values())))
+        for limit in (1, 5, 40):
+            found = scan_world(self.world_path, center=center, dist=30, nearest=limit)
+            self.assertEqual(len(found), limit)
+            self.assertLessEqual(get_blocks(found), get_blocks(everything))
+            np.testing.assert_array_equal(np.sort(np.concatenate(list(found.dists.values()))), dists[:limit])
+
+    def test_nearest_must_be_positive(self):
+        with mock.patch.object(sys, 'argv', ['scan.py', '0', '0', '0', '--nearest', '0']), \
+                contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            scan.parse()
+
+
+class EntitiesTest(WorldTestCase):
+
+    def test_entities_match_terrain(self):
+        # every chest, spawner and brewing stand in a generated world has a block entity
+        center = (-3, 0, 9)
+        entity_blocks = set(scan.BLOCK_ENTITY_BLOCKS.values())
+        expected = {block for block in get_blocks(scan_world(self.world_path, center=center)) if block[0] in entity_blocks}
+        details = {}
+        found = scan_world(self.world_path, center=center, entities=True, details=details)
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(get_blocks(found), expected)
+        self.assertEqual(set(details), {tuple(block[1:]) for block in expected})
+
+
+class BatchTest(WorldTestCase):
+
+    def test_batch_matches_single_queries(self):
+        lines = [
+            '# overlapping queries in both dimensions',
+            '5 10 -3 --dist 20 --coal --name first',
+            '',
+            '10 -20 0 --dist 12 --ymin -40 --ymax 0 --iron',
+            '0 0 0 --dist 15 --nether',
+            '-5 -30 5 --sphere 14',
+            '3 0 3 --dist 25 --nearest 7',
+            '0 0 0 --dist 30 --entities',
+        ]
+        queries = scan.parse_batch_queries(iter(lines), '<test>')
+        self.assertEqual([name for name, _query in queries][0], 'first')
+        self.assertEqual(len(queries), 6)
+        expected = [get_blocks(scan.scan(world_path=self.world_path, **query)) for _name, query in queries]
+        with tempfile.TemporaryDirectory(prefix='mc-scan-test-') as index_dir:
+            for index_dir in (None, Path(index_dir)):
+                if index_dir is not None:
+                    with scan.open_world_db(self.world_path) as db:
+                        scan.ChunkPresence.build(index_dir, self.world_path, db)
+                        scan.BlockIndex.build(index_dir, self.world_path, 0, db)
+                results = scan.scan_batch([query for _name, query in queries], self.world_path, scan.ScanStats(), index_dir=index_dir)
+                self.assertEqual([get_blocks(found) for found in results], expected)
+
+
+class CensusTest(WorldTestCase):
+
+    def test_census_counts(self):
+        totals = collections.Counter()
+        layers = collections.Counter()
+        chunks = collections.Counter()
+        with scan.open_world_db(self.world_path) as db:
+            for key, data in self.bedrock.leveldb.iterate(db):
+                parsed = scan.parse_chunk_key(key)
+                if parsed is None or parsed[0] != 0 or parsed[3] != scan.TAG_SUBCHUNK_PREFIX:
+                    continue
+                _dimension, chunk_x, chunk_z, _tag, subchunk_y = parsed
+                subchunk = scan.SubChunk(data)
+                for y in range(scan.CHUNK_SIZE):
+                    counts = np.bincount(subchunk.blocks[:, :, y].reshape(-1), minlength=len(subchunk.palette))
+                    for entry, count in zip(subchunk.palette, counts.tolist()):
+                        if count:
+                            totals[entry] += count
+                            layers[(entry, subchunk_y * scan.CHUNK_SIZE + y)] += count
+                            chunks[(entry, chunk_x, chunk_z)] += count
+
+        census = scan.get_census_json(scan.take_census(self.world_path, [0], scan.ScanStats())[0], by_chunk=True)
+        self.assertEqual(census['chunks'], (2 * RADIUS + 1) ** 2)
+        self.assertEqual({(block['name'], block['dv']): block['count'] for block in census['blocks']}, dict(totals))
+        self.assertEqual([block['count'] for block in census['blocks']], sorted(totals.values(), reverse=True))
+        for block in census['blocks']:
+            entry = (block['name'], block['dv'])
+            self.assertEqual(block['layers'], {str(y): count for (e, y), count in layers.items() if e == entry})
+            self.assertEqual(block['by_chunk'], {f'{x},{z}': count for (e, x, z), count in chunks.items() if e == entry})
+            self.assertEqual(block['chunks'], len(block['by_chunk']))
+
+
+class ShapeTest(WorldTestCase):
+
+    def check_shape(self, shape: scan.QueryShape, inside):
+        center = shape.center if hasattr(shape, 'center') else (0, 0, 0)
+        everything = get_blocks(scan_world(self.world_path, center=center, dist=40))
+        expected = {block for block in everything if inside(*block[1:])}
+        (x_min, x_max), (z_min, z_max) = shape.get_bounds()
+        found = scan.scan(
+            dimension=0,
+            center=center,
+            x_range=(x_min, x_max),
+            y_range=(scan.Y_MIN, scan.Y_MAX),
+            z_range=(z_min, z_max),
+            max_dist=40,
+            world_path=self.world_path,
+            optional_blocks_chosen={group: True for group in scan.OPTIONAL_BLOCKS},
+            shape=shape,
+        )
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(get_blocks(found), expected)
+
+    def test_sphere(self):
+        self.check_shape(
+            scan.SphereShape((3, -20, -5), 17.5),
+            lambda x, y, z: (x - 3) ** 2 + (y + 20) ** 2 + (z + 5) ** 2 <= 17.5 ** 2,
+        )
+
+    def test_cylinder(self):
+        self.check_shape(scan.CylinderShape((-4, 0, 6), 9), lambda x, y, z: (x + 4) ** 2 + (z - 6) ** 2 <= 81)
+
+    def test_tunnel(self):
+        # heading 90 is east (+x); a cone from 4 wide to 12 wide
+        def inside(x, y, z):
+            along = x + 10
+            width = 4 + 8 * min(max(along / 30, 0), 1)
+            return 0 <= along <= 30 and (z - 2) ** 2 + (y - 10) ** 2 <= (width / 2) ** 2
+        self.check_shape(scan.TunnelShape((-10, 10, 2), 90, 30, 4, 12), inside)
+
+    def test_polygon(self):
+        # a right triangle with its corner at -20,-20
+        self.check_shape(
+            scan.PolygonShape([(-20, -20), (20, -20), (-20, 20)]),
+            lambda x, y, z: x >= -20 and z >= -20 and x + z <= 0,
+        )
+
+    def test_y_range_from_shape(self):
+        with mock.patch.object(sys, 'argv', ['scan.py', '0', '-40', '0', '--sphere', '30', '--world', str(self.world_path)]):
+            opts = scan.parse()
+        self.assertEqual((opts.ymin, opts.ymax), (max(-70, scan.Y_MIN), -10))
+        self.assertTrue(math.isclose(scan.get_query(opts)['shape'].radius, 30))
+
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bedrock = get_bedrock()
+        self.tmp = tempfile.TemporaryDirectory(prefix='mc-scan-test-')
+        self.world_path = Path(self.tmp.name) / 'world'
+        self.index_dir = Path(self.tmp.name) / 'index'
+        scan.generate_world(self.world_path, RADIUS, ore_density=0.01, palette_size=4, dimensions=[0], seed=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build_index(self, index_dir: Path, previous=None) -> scan.BlockIndex:
+        with scan.open_world_db(self.world_path) as db:
+            scan.ChunkPresence.build(index_dir, self.world_path, db)
+            return scan.BlockIndex.build(index_dir, self.world_path, 0, db, previous=previous)
+
+    def test_index_matches_scan(self):
+        index = self.build_index(self.index_dir)
+        presence = scan.ChunkPresence.load(self.index_dir, self.world_path, 0)
+        self.assertGreater(len(scan_world(self.world_path)), 0)
+        for center in ((0, 0, 0), (7, -20, -11)):
+            expected = scan_world(self.world_path, center=center, dist=20)
+            self.assertEqual(scan_world(self.world_path, center=center, dist=20, index=index).get_digest(), expected.get_digest())
+            self.assertEqual(scan_world(self.world_path, center=center, dist=20, presence=presence).get_digest(), expected.get_digest())
+
+    def test_index_query_doesnt_open_world(self):
+        self.build_index(self.index_dir)
+        args = ['0', '0', '0', '--dist', '20', '--json', '--world', str(self.world_path), '--index-dir', str(self.index_dir)]
+        expected = run_cli(args + ['--no-index'])
+        open_world_db = scan.open_world_db
+        with mock.patch.object(scan, 'open_world_db', side_effect=open_world_db) as opened:
+            self.assertEqual(run_cli(args), expected)
+            self.assertEqual(opened.call_count, 0)
+
+            # unless the index has to be refreshed first
+            mark_updated(self.world_path)
+            self.assertEqual(run_cli(args), expected)
+            self.assertEqual(opened.call_count, 1)
+
+    def test_refresh_matches_full_build(self):
+        previous = self.build_index(self.index_dir)
+
+        # fill one subchunk with diamonds and empty another
+        blocks = np.ones((scan.CHUNK_SIZE, scan.CHUNK_SIZE, scan.CHUNK_SIZE), dtype=np.int64)
+        db = self.bedrock.leveldb.open(str(self.world_path / 'db'))
+        try:
+            self.bedrock.leveldb.put(
+                db,
+                scan.chunk_key(1, -1, 0, scan.TAG_SUBCHUNK_PREFIX, 0),
+                scan.encode_subchunk(['minecraft:stone', 'minecraft:diamond_ore'], blocks),
+            )
+            self.bedrock.leveldb.put(
+                db,
+                scan.chunk_key(-2, 0, 0, scan.TAG_SUBCHUNK_PREFIX, -3),
+                scan.encode_subchunk(['minecraft:stone'], blocks * 0),
+            )
+        finally:
+            self.bedrock.leveldb.close(db)
+        mark_updated(self.world_path)
+
+        self.assertIsNone(scan.BlockIndex.load(self.index_dir, self.world_path, 0))
+        self.assertIsNone(scan.ChunkPresence.load(self.index_dir, self.world_path, 0))
+        with scan.open_world_db(self.world_path) as db:
+            scan.refresh_index(self.index_dir, self.world_path, 0, db)
+        refreshed = scan.BlockIndex.load(self.index_dir, self.world_path, 0)
+        self.assertIsNotNone(refreshed)
+        self.assertIsNotNone(scan.ChunkPresence.load(self.index_dir, self.world_path, 0))
+        self.assertNotEqual(len(refreshed.coords), len(previous.coords))
+
+        full = self.build_index(Path(self.tmp.name) / 'full')
+        self.assertEqual(refreshed.names, full.names)
+        np.testing.assert_array_equal(get_sorted_blocks(refreshed), get_sorted_blocks(full))
+        self.assertEqual(
+            scan_world(self.world_path, index=refreshed).get_digest(),
+            scan_world(self.world_path).get_digest(),
+        )
+
+
+def get_sorted_blocks(index: scan.BlockIndex) -> np.ndarray:
+    """
+    (N, 4) name index, x, y, z of everything in an index, sorted
+    """
+    names = np.zeros(len(index.coords), dtype=np.int64)
+    for name_index, _chunk_x, _chunk_z, start, end in index.chunks.tolist():
+        names[start:end] = name_index
+    blocks = np.column_stack((names, index.coords))
+    return blocks[np.lexsort(blocks.T[::-1])]
+
+
+class ResultsTest(unittest.TestCase):
+
+    def test_batches_match_one_add(self):
+        rng = np.random.default_rng(0)
+        coords = rng.integers(-100, 100, size=(1000, 3))
+        whole = scan.ScanResults((3, -5, 7))
+        whole.add('minecraft:coal_ore', coords)
+        batched = scan.ScanResults((3, -5, 7))
+        for number, batch in enumerate(np.array_split(coords, 20)):
+            batched.add('minecraft:coal_ore', batch)
+            if number == 10:
+                # reading part way through mustn't lose or repeat anything
+                self.assertEqual(len(batched.coords['minecraft:coal_ore']), len(coords) // 20 * 11)
+        self.assertEqual(len(batched), len(coords))
+        np.testing.assert_array_equal(batched.coords['minecraft:coal_ore'], whole.coords['minecraft:coal_ore'])
+        np.testing.assert_array_equal(batched.dists['minecraft:coal_ore'], whole.dists['minecraft:coal_ore'])
+
+
+class ClusterTest(unittest.TestCase):
+
+    def flood_fill(self, blocks: dict[scan.Coords, str], gap: int) -> list[set[scan.Coords]]:
+        seen = set()
+        components = []
+        for start in blocks:
+            if start in seen:
+                continue
+            seen.add(start)
+            stack = [start]
+            component = set()
+            while stack:
+                x, y, z = stack.pop()
+                component.add((x, y, z))
+                for dx in range(-gap, gap + 1):
+                    for dy in range(-gap, gap + 1):
+                        for dz in range(-gap, gap + 1):
+                            neighbour = (x + dx, y + dy, z + dz)
+                            if neighbour in blocks and neighbour not in seen:
+                                seen.add(neighbour)
+                                stack.append(neighbour)
+            components.append(component)
+        return components
+
+    def test_clusters_match_flood_fill(self):
+        rng = np.random.default_rng(0)
+        coords = np.unique(rng.integers(-12, 12, size=(600, 3)), axis=0)
+        names = rng.choice(['minecraft:coal_ore', 'minecraft:iron_ore'], size=len(coords))
+        blocks = {tuple(xyz): name for xyz, name in zip(coords.tolist(), names.tolist())}
+        results = scan.ScanResults((0, 0, 0))
+        for name in sorted(set(blocks.values())):
+            results.add(name, np.array([xyz for xyz, block in blocks.items() if block == name]))
+
+        for gap in (1, 2):
+            expected = []
+            for component in self.flood_fill(blocks, gap):
+                xs, ys, zs = zip(*component)
+                expected.append((
+                    (min(xs), min(ys), min(zs)),
+                    (max(xs), max(ys), max(zs)),
+                    len(component),
+                    dict(collections.Counter(blocks[xyz] for xyz in component)),
+                ))
+            clusters = results.clustered(gap)
+            got = [(cluster.min, cluster.max, cluster.count, cluster.blocks) for cluster in clusters]
+            self.assertEqual(sorted(got, key=repr), sorted(expected, key=repr))
+            self.assertEqual([cluster.dist for cluster in clusters], sorted(cluster.dist for cluster in clusters))
+
+
+if __name__ == '__main__':
+    unittest.main()